@@ -3,7 +3,40 @@
 import numpy as np
 import xarray as xr
 
-from .plot_functions import var_name, global_minmax, plot_reg_coeffs, plot_amplitudes, plot_hscales, plot_vscales
+from .records import amplitudes_names, hscales_var_names, vscales_var_names, balprojs_names, record_name
+from . import records
+from .records import records_dtype, layout_dtype, detect_layout, to_native
+from .index import load_index, find_record, read_indexed_record
+from . import store
+from .store import open_store
+from .multi import open_many
+from .ensemble import ensemble_stats
+from .checks import validate, validate_many
+from .registry import open_matrix, set_memory_budget, clear_registry, registry_info
+from .stats import array_stats, RecordStats
+from .report import render_report
+from . import profiling
+from .profiling import profile
+from . import regrid
+from . import covariance
+from . import balance
+
+# The plotting functions (and matplotlib and cartopy) are only imported when they are used for the first time,
+# so that reading the matrices only needs numpy and xarray
+_plot_functions = ['var_name', 'global_minmax', 'plot_reg_coeffs', 'plot_amplitudes', 'plot_hscales', 'plot_vscales', 
+                   'prepare_axes', 'clear_axes']
+
+def __getattr__(name):
+    if name in _plot_functions:
+        from . import plot_functions
+        return getattr(plot_functions, name)
+    # gb.open (it isn't a global of this module, so that the builtin open is still used by the methods below)
+    if name == 'open':
+        return open_matrix
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+def __dir__():
+    return sorted(list(globals()) + _plot_functions + ['open'])
 
 class Berror(object):   
     """
@@ -16,9 +49,12 @@ class Berror(object):
     
     def __init__(self, file_name):
         self.file_name = file_name
+        self._stats = {}
+        self._operators = {}
+        self._vertical = {}
         #self._my_name = ''
     
-    def read_records(self):
+    def read_records(self, lazy=False, index=False, native=False, profile=False):
         """
         read_records
         ------------
@@ -26,11 +62,28 @@ class Berror(object):
         This method reads the first three records of the background error covariance matrix (nlat, nlon and nlev).
         These records are used to calculate the size of the remainder records from the matrix. All attributes read from
         the matrix are provided by this function. The plotting of the records are made through the use of the xarray's 'plot()'
-        method; depending on the use, it can be necessary to to load the matplotlib and cartopy modules.
+        method; depending on the use, it can be necessary to to load the matplotlib and cartopy modules. The layout of the
+        file (byte order, sizes of the record markers, integers and reals and the list of control variables) is detected
+        from its first records (see detect_layout), so that little endian or double precision files and matrices 
+        without some of the variables (eg., oz and cw) are read with the structure of their own layout. The records
+        are kept in a single xarray dataset, with the coordinates shared by all of them (see to_dataset), and the 
+        amplitudes, hscales, vscales and balprojs dictionaries are views into it.
         
         Input parameters
         ----------------
-            None.
+            lazy  : if True, the file is memory-mapped instead of read at once; the records are views into the map
+                    and each one is only read from disk when its values are accessed (default: False)
+            index : if True, the byte offset of each record is taken from the index of the file, which is kept in a
+                    sidecar file (file_name + '.idx') and only rebuilt when the size or the modification time of the 
+                    file change (default: False)
+            native: if True, the records are converted once, at load time, from big endian to the native byte order 
+                    (float32); the bytes are swapped in place, so the memory footprint is the same as with native=False 
+                    (the size of the file), but the operations on the records (eg., min, mean, contourf) don't need 
+                    to swap or copy the values every time; the reshapes (Fortran order) and transposes are views of 
+                    the records, as with native=False. It can't be used along with lazy=True, since the memory-mapped 
+                    records are read-only (default: False)
+            profile: if True, the wall time, the bytes read and the peak of memory allocated by each stage of the 
+                     reading are measured and kept in the profile attribute (see the profile function) (default: False)
 
         Result
         ------
@@ -53,6 +106,7 @@ class Berror(object):
             hscales_var_names : names of the variables in the hscales dictionary
             vscales           : dictionary with xarrays for the vertical length scales
             vscales_var_names : names of the variables in the vscales dictionary
+            sigs              : dictionary with the number of levels of each control variable (as written in the file)
                     
         Use
         ---
@@ -71,228 +125,862 @@ class Berror(object):
             bfile_amp_sf = bfile.amplitudes['sf']
             
             bfile_amp_sf.plot.contourf()    
+            
+            # Memory-mapped reading (only the records that are accessed are read from disk)
+            
+            bfile.read_records(lazy=True)
+            
+            bfile.amplitudes['sst'].values
+            
+            # Reading with the byte offsets kept in the index file (faster when the same file is opened again)
+            
+            bfile.read_records(index=True)
+            
+            # Records converted to the native byte order (float32)
+            
+            bfile.read_records(native=True)
+            
+            # Time, bytes read and peak of memory of each stage of the reading
+            
+            bfile.read_records(profile=True)
+            
+            print(bfile.profile.report())
         """
     
-        # Reads the first three records to define the grid
-        dt = np.dtype([ ('grid', '3>i4') ])
-
-        with open(self.file_name, 'rb') as ftmp:
-            fobj = np.fromfile(ftmp, dtype=dt, count=3, offset=4)  
+        if profile:
+            with profiling.profile('read_records ' + str(self.file_name)) as self.profile:
+                return self.read_records(lazy=lazy, index=index, native=native)
         
-        # Calculate the coordinates for lats, lons and levs dimensions
-        nlev = fobj[0]['grid'][0]
-        nlat = fobj[0]['grid'][1]
-        nlon = fobj[0]['grid'][2]
-       
-        self.nlat = nlat
-        self.nlon = nlon
-        self.nlev = nlev
-    
-        self.lats = np.linspace(-90,90, self.nlat)
-        self.lons = np.linspace(0,360, self.nlon)
-        self.levs = np.arange(1, self.nlev+1)
+        if native and lazy:
+            raise ValueError('The native and lazy options can not be used together')
         
-        # Define the records sizes from within the file ('>f4' indicates 32 bits floats, big endian)
-        tnlat = str(self.nlat) + '>f4'
-        s2d = str(self.nlat*self.nlev) + '>f4'
-        sst2d = str(self.nlat*self.nlon) + '>f4'
-        s3d = str(self.nlat*self.nlev*self.nlev) + '>f4'
-
-        # Define a structure for the records within the file ('padX' = 4 bytes; '>i4' indicates 32 bits integers, big endian)
-        # Maybe this isn't the best way to read the records but it is explicity, at least
-        dt =          [ ('grid', '3>i4'), 
-                   
-                        ('pad1', '>i4'), ('agvin',s3d), 
-                        ('pad2', '>i4'), ('bgvin', s2d),
-                        ('pad3', '>i4'), ('wgvin', s2d), 
-                       
-                        ('pad4', '>i4'), ('sf', '|a5'), ('sig_sf', '>i4'), ('pad5', '>i4'), 
-                        ('pad6', '>i4'), ('corzin_sf', s2d), ('pad7', '>i4'), 
-                        ('pad8', '>i4'), ('hscalesin_sf', s2d), ('pad9', '>i4'), 
-                        ('pad10', '>i4'), ('vscalesin_sf', s2d), ('pad11', '>i4'), 
-                   
-                        ('pad12', '>i4'), ('vp', '|a5'), ('sig_vp', '>i4'), ('pad13', '>i4'),
-                        ('pad14', '>i4'), ('corzin_vp', s2d), ('pad15', '>i4'), 
-                        ('pad16', '>i4'), ('hscalesin_vp', s2d), ('pad17', '>i4'), 
-                        ('pad18', '>i4'), ('vscalesin_vp', s2d), ('pad19', '>i4'), 
-                   
-                        ('pad20', '>i4'), ('t', '|a5'), ('sig_t', '>i4'), ('pad21', '>i4'),
-                        ('pad22', '>i4'), ('corzin_t', s2d), ('pad23', '>i4'), 
-                        ('pad24', '>i4'), ('hscalesin_t', s2d), ('pad25', '>i4'), 
-                        ('pad26', '>i4'), ('vscalesin_t', s2d), ('pad27', '>i4'), 
-                   
-                        ('pad28', '>i4'), ('q', '|a5'), ('sig_q', '>i4'), ('pad29', '>i4'),
-                        ('pad30', '>i4'), ('corzin_q', s2d), ('corqin_q', s2d), ('pad31', '>i4'), 
-                        ('pad32', '>i4'), ('hscalesin_q', s2d), ('pad33', '>i4'), 
-                        ('pad34', '>i4'), ('vscalesin_q', s2d), ('pad35', '>i4'), 
-                   
-                        ('pad36', '>i4'), ('oz', '|a5'), ('sig_oz', '>i4'), ('pad37', '>i4'),
-                        ('pad38', '>i4'), ('corzin_oz', s2d), ('pad39', '>i4'), 
-                        ('pad40', '>i4'), ('hscalesin_oz', s2d), ('pad41', '>i4'), 
-                        ('pad42', '>i4'), ('vscalesin_oz', s2d), ('pad43', '>i4'), 
-                                      
-                        ('pad44', '>i4'), ('cw', '|a5'), ('sig_cw', '>i4'), ('pad45', '>i4'),
-                        ('pad46', '>i4'), ('corzin_cw', s2d), ('pad47', '>i4'), 
-                        ('pad48', '>i4'), ('hscalesin_cw', s2d), ('pad49', '>i4'), 
-                        ('pad50', '>i4'), ('vscalesin_cw', s2d), ('pad51', '>i4'), 
-                   
-                        ('pad52', '>i4'), ('ps', '|a5'), ('sig_ps', '>i4'), ('pad53', '>i4'), 
-                        ('pad54', '>i4'), ('corpin_ps', tnlat), ('pad55', '>i4'), 
-                        ('pad56', '>i4'), ('hscalespin_ps', tnlat), ('pad57', '>i4'), 
-                   
-                        ('pad58', '>i4'), ('sst', '|a5'), ('sig_sst', '>i4'), ('pad59', '>i4'),
-                        ('pad60', '>i4'), ('corsstin_sst', sst2d), ('pad61', '>i4'), 
-                        ('pad62', '>i4'), ('hsstin_ps', sst2d), ('pad63', '>i4') ]   
-    
-        dt_obj = np.dtype(dt)#, align=True) # align=True should be automatic (?) 
-                                            # accounts for 4 bytes padding (before and after the records)
-    
-        # Opens the file again to read all the records
-        with open(self.file_name, 'rb') as ftmp:
-            fobj = np.fromfile(ftmp, dtype=dt_obj, count=-1, offset=4) # count=-1 reads the whole file
+        if index:
+            # Reads the dimensions and the byte offset of each record from the index of the file
+            with profiling.stage('index'):
+                fidx = load_index(self.file_name)
+            
+            self._set_grid(*fidx['grid'])
+            
+            self.sigs = dict(fidx['sigs'])
+            
+            if lazy:
+                with profiling.stage('memmap'):
+                    fobj = np.memmap(self.file_name, dtype=np.uint8, mode='r')
+                    fields = {entry['name']: read_indexed_record(fobj, entry) for entry in fidx['records']}
+            else:
+                nbytes = sum(int(np.prod(entry['shape']))*np.dtype(entry['dtype']).itemsize for entry in fidx['records'])
+                with profiling.stage('records', nbytes), open(self.file_name, 'rb') as ftmp:
+                    fields = {entry['name']: read_indexed_record(ftmp, entry) for entry in fidx['records']}
+        
+        else:
+            with open(self.file_name, 'rb') as ftmp:
+                # Reads the first records to define the grid and the layout of the file (byte order, sizes of the 
+                # record markers, integers and reals and the control variables), see detect_layout in records.py
+                with profiling.stage('header'):
+                    layout, grid = detect_layout(ftmp)
+            
+                # Calculate the coordinates for lats, lons and levs dimensions
+                self._set_grid(grid[0], grid[1], grid[2])
+            
+                # Define a structure for the records within the file (see records_dtype and layout_dtype in records.py)
+                dt_obj = layout_dtype(int(self.nlat), int(self.nlon), int(self.nlev), layout)
+            
+                if not lazy:
+                    # Reads all the records from the same opened file
+                    with profiling.stage('fromfile', dt_obj.itemsize):
+                        ftmp.seek(layout.marker)
+                        fobj = np.fromfile(ftmp, dtype=dt_obj, count=-1) # count=-1 reads the whole file
+        
+            if lazy:
+                # Maps the records into memory; the byte offset of each record is given by the structure above
+                # and the arrays below are views into the map, which are only read from disk when accessed
+                with profiling.stage('memmap'):
+                    fobj = np.memmap(self.file_name, dtype=dt_obj, mode='r', offset=layout.marker, shape=(1,))
+        
+            fields = fobj[0]
+            
+            self.sigs = {var: int(fields['sig_' + var]) for var in layout.vars}
+            
+            fields = {name: fields[name] for name in dt_obj.names if not name.startswith(('pad', 'sig_', 'grid'))}
+        
+        if native:
+            # Swaps the bytes of each record in place, once (if the byte order of the file isn't the native one)
+            with profiling.stage('native'):
+                fields = {name: to_native(data) for name, data in fields.items()}
     
+        self._stats = {}
+        
+        # Only the variables found in the file (eg., matrices without oz and cw)
+        self.amplitudes_names = {var: name for var, name in amplitudes_names.items() if name in fields}
+        self.hscales_var_names = {var: name for var, name in hscales_var_names.items() if name in fields}
+        self.vscales_var_names = {var: name for var, name in vscales_var_names.items() if name in fields}
+        
+        # All the records are kept in a single dataset, with the coordinates (and their indexes) shared by all of them
+        # (see to_dataset); the horizontal length scales are in meters (they are divided by 1000 in plot_functions.py)
+        recs = [(var, 'balprojs', fields[var]) for var in balprojs_names]
+        
+        for names, kind in [(self.amplitudes_names, 'amplitudes'), (self.hscales_var_names, 'hscales'), 
+                            (self.vscales_var_names, 'vscales')]:
+            recs.extend((var, kind, fields[name]) for var, name in names.items())
+        
+        with profiling.stage('dataset'):
+            ds = self._records_dataset(recs)
+        
+        self._dataset = ds
+        
         #
-        # Records reading - Regression coefficients (balance projection matrices)  
+        # Records dictionaries (views into the dataset) - Regression coefficients (balance projection matrices),
+        # amplitudes (standard deviations) and horizontal and vertical length scales
         #
         
-        balprojs = {} 
-    
-        self.balprojs = balprojs
-    
-        agvin = np.reshape(fobj[0]['agvin'], (self.nlat, self.nlev, self.nlev), order='F')
-        da_agvin = xr.DataArray(agvin, dims=['latitude', 'level', 'level_2'], coords={'latitude':self.lats, 'level':self.levs, 'level_2':self.levs})
-        da_agvin = da_agvin.transpose('level', 'latitude', 'level_2')
-        da_agvin = da_agvin.rename('agvin')
+        with profiling.stage('balprojs'):
+            self.balprojs = {var: ds[var] for var in balprojs_names}
+        
+        with profiling.stage('amplitudes'):
+            self.amplitudes = {var: ds[name] for var, name in self.amplitudes_names.items()}
+        
+        with profiling.stage('hscales'):
+            self.hscales = {var: ds[name] for var, name in self.hscales_var_names.items()}
+        
+        with profiling.stage('vscales'):
+            self.vscales = {var: ds[name] for var, name in self.vscales_var_names.items()}
 
-        balprojs['agvin'] = da_agvin
-    
-        bgvin = np.reshape(fobj[0]['bgvin'], (self.nlat, self.nlev), order='F')
-        da_bgvin = xr.DataArray(bgvin, dims=['latitude', 'level'], coords={'latitude':self.lats, 'level':self.levs})
-        da_bgvin = da_bgvin.transpose('level', 'latitude')
-        da_bgvin = da_bgvin.rename('bgvin')
+    def read_record(self, var, kind='amplitudes', native=False):
+        """
+        read_record
+        -----------
+        
+        This method reads a single record of the background error covariance matrix, seeking straight to its byte
+        offset as given by the index of the file (see the index parameter of the read_records method). The attributes
+        nlat, nlon, nlev, lats, lons and levs are also defined.
+        
+        Input parameters
+        ----------------
+            var   : name of the variable (eg., 'sf', 'qin', 'sst' or 'agvin')
+            kind  : kind of the record, one of 'amplitudes', 'hscales', 'vscales' or 'balprojs' (default: 'amplitudes')
+            native: if True, the record is converted to the native byte order (see read_records) (default: False)
 
-        balprojs['bgvin'] = da_bgvin
-    
-        wgvin = np.reshape(fobj[0]['wgvin'], (self.nlat, self.nlev), order='F')
-        da_wgvin = xr.DataArray(wgvin, dims=['latitude', 'level'], coords={'latitude':self.lats, 'level':self.levs})
-        da_wgvin = da_wgvin.transpose('level', 'latitude')
-        da_wgvin = da_wgvin.rename('wgvin')
-    
-        balprojs['wgvin'] = da_wgvin      
+        Result
+        ------
+            xarray with the record, with the same dimensions as the one provided by read_records
+                    
+        Use
+        ---
+            import gsiberror as gb
         
-        #
-        # Records reading - Amplitudes (standard deviations)
-        #
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile_amp_sst = bfile.read_record('sst', 'amplitudes')
+        """
+        
+        fidx = load_index(self.file_name)
+        
+        self._set_grid(*fidx['grid'])
         
-        amplitudes = {}
-        
-        self.amplitudes = amplitudes
-        
-        amplitudes_names = {
-            'sf':  'corzin_sf', 
-            'vp':  'corzin_vp', 
-            't':   'corzin_t', 
-            'q':   'corzin_q', 
-            'qin': 'corqin_q',
-            'oz':  'corzin_oz', 
-            'ps':  'corpin_ps', 
-            'cw':  'corzin_cw', 
-            'sst': 'corsstin_sst',
-        }
-        
-        self.amplitudes_names = amplitudes_names
-        
-        # Loop over the variables to create a dictionary with xarrays for the amplitudes
-        for var in amplitudes_names.items():
-            if var[0] == 'ps':
-                corzin_var = np.reshape(fobj[0][var[1]], (self.nlat), order='F')
-                da_corzin_var = xr.DataArray(corzin_var, dims=['latitude'], coords={'latitude':self.lats})
-            elif var[0] == 'sst':
-                corzin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlon), order='F')
-                da_corzin_var = xr.DataArray(corzin_var, dims=['latitude', 'longitude'], coords={'latitude':self.lats, 'longitude':self.lons})
+        self.sigs = dict(fidx['sigs'])
+        
+        with open(self.file_name, 'rb') as ftmp:
+            data = read_indexed_record(ftmp, find_record(fidx, var, kind))
+        
+        if native:
+            data = to_native(data)
+        
+        return self._record_dataarray(var, kind, data)
+        
+    def iter_records(self):
+        """
+        iter_records
+        ------------
+        
+        This method is a generator that reads the background error covariance matrix one Fortran record at a time,
+        following the 4 bytes length markers written before and after each record. The name of each control variable
+        is read from the file, so that a missing or unexpected variable raises an error instead of misaligning the
+        records that follow it. Only one record is held in memory at a time (the largest one is the record with agvin,
+        bgvin and wgvin). The attributes nlat, nlon, nlev, lats, lons and levs are defined when the first record is read.
+        
+        Input parameters
+        ----------------
+            None.
+
+        Result
+        ------
+            Tuples with (name, kind, record), where name is the key of the record in the dictionaries filled by the 
+            read_records method (eg., 'sf', 'qin' or 'agvin'), kind is one of 'balprojs', 'amplitudes', 'hscales' 
+            or 'vscales' and record is a xarray with the same dimensions as the one provided by read_records
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            for name, kind, rec in bfile.iter_records():
+                print(name, kind, float(rec.max()))
+        """
+        
+        recs = records.iter_records(self.file_name)
+        
+        grid = next(recs)[2]
+        
+        self._set_grid(grid[0], grid[1], grid[2])
+        
+        self.sigs = {}
+        
+        self._stats = {}
+        
+        for var, kind, data in recs:
+            if kind == 'tag':
+                self.sigs[var] = int(data[0])
             else:
-                corzin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlev), order='F')
-                da_corzin_var = xr.DataArray(corzin_var, dims=['latitude', 'level'], coords={'latitude':self.lats, 'level':self.levs})
-                da_corzin_var = da_corzin_var.transpose('level', 'latitude')
+                yield var, kind, self._record_dataarray(var, kind, data)
+        
+    def to_gcv(self, file_name):
+        """
+        to_gcv
+        ------
+        
+        This method writes the records of the background error covariance matrix (eg., after scaling the amplitudes
+        or the length scales) to a GSI compatible file (.gcv format). The whole file (Fortran record markers and big 
+        endian values) is built in a single buffer and written at once. Reading the written file with read_records
+        gives the same values (bit by bit) as the ones written.
+        
+        Input parameters
+        ----------------
+            file_name: name of the file to be written
+
+        Result
+        ------
+            None.
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
             
-            da_corzin_var = da_corzin_var.rename(var[1])
+            bfile.hscales['sf'] = bfile.hscales['sf']*1.2
+            
+            bfile.to_gcv('arquivo_matriz_B_hscales_sf_x1.2.gcv')
+        """
         
-            amplitudes[var[0]] = da_corzin_var
+        nlat, nlon, nlev = int(self.nlat), int(self.nlon), int(self.nlev)
         
-        #
-        # Records reading - Horizontal length scales (in meters) -> the in plot_functions.py script, the horizontal length scales
-        #                                                           are divided by 1000
-        #
+        sigs = getattr(self, 'sigs', {})
         
-        hscales = {}
-        
-        self.hscales = hscales
-        
-        hscales_var_names = {
-            'sf':  'hscalesin_sf', 
-            'vp':  'hscalesin_vp', 
-            't':   'hscalesin_t', 
-            'q':   'hscalesin_q', 
-            'oz':  'hscalesin_oz', 
-            'ps':  'hscalespin_ps', 
-            'cw':  'hscalesin_cw', 
-            'sst': 'hsstin_ps',
-        }        
-        
-        self.hscales_var_names = hscales_var_names
-        
-        # Loop over the variables to create a dictionary with xarrays for the horizontal length scales
-        for var in hscales_var_names.items():
-            if var[0] == 'ps':
-                hscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat), order='F')
-                da_hscalesin_var = xr.DataArray(hscalesin_var, dims=['latitude'], coords={'latitude':self.lats})
-            elif var[0] == 'sst':
-                hscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlon), order='F')
-                da_hscalesin_var = xr.DataArray(hscalesin_var, dims=['latitude', 'longitude'], coords={'latitude':self.lats, 'longitude':self.lons})
+        # This function returns the values of a record in the Fortran order of the axes
+        def fortran(var, da):
+            dims, axes = records.record_dims(var)
+            return da.transpose(*[dims[i] for i in np.argsort(axes)]).values
+        
+        recs = [[('>i4', np.array([nlev, nlat, nlon]))],
+                [('>f4', fortran(var, self.balprojs[var])) for var in balprojs_names]]
+        
+        for var in records.control_vars:
+            
+            if var not in self.hscales:
+                continue
+            
+            if var in ('ps', 'sst'):
+                isig = sigs.get(var, 1)
+            else:
+                isig = sigs.get(var, nlev)
+            
+            recs.append([('|S5', np.array(var.ljust(5).encode('ascii'))), ('>i4', np.array(isig))])
+            
+            if var == 'q' and 'qin' in self.amplitudes:
+                recs.append([('>f4', fortran(var, self.amplitudes['q'])), ('>f4', fortran(var, self.amplitudes['qin']))])
             else:
-                hscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlev), order='F')
-                da_hscalesin_var = xr.DataArray(hscalesin_var, dims=['latitude', 'level'], coords={'latitude':self.lats, 'level':self.levs})
-                da_hscalesin_var = da_hscalesin_var.transpose('level', 'latitude')
+                recs.append([('>f4', fortran(var, self.amplitudes[var]))])
             
-            da_hscalesin_var = da_hscalesin_var.rename(var[1])
+            recs.append([('>f4', fortran(var, self.hscales[var]))])
+            
+            if var in self.vscales:
+                recs.append([('>f4', fortran(var, self.vscales[var]))])
         
-            hscales[var[0]] = da_hscalesin_var           
+        records.write_fortran_records(file_name, recs)
         
-        #
-        # Records reading - Vertical length scales
-        #
+    def record_stats(self, kind, var):
+        """
+        record_stats
+        ------------
         
-        vscales = {}
+        This method returns the statistics (minimum, maximum, mean, standard deviation and number of NaN values) of 
+        a record. The statistics are computed on demand (the minimum and maximum together, eg. for the global_minmax
+        function, and the others only when one of them is used), once, and kept until the record is replaced in its 
+        dictionary (eg., bfile.hscales['sf'] = bfile.hscales['sf']*1.2) or the records are read again. If the values 
+        of a record are changed in place, the invalidate_stats method must be called.
         
-        self.vscales = vscales
+        Input parameters
+        ----------------
+            kind: kind of the record, one of 'amplitudes', 'hscales', 'vscales' or 'balprojs'
+            var : name of the variable (eg., 'sf', 'qin', 'sst' or 'agvin')
 
-        vscales_var_names = {
-            'sf':  'vscalesin_sf', 
-            'vp':  'vscalesin_vp', 
-            't':   'vscalesin_t', 
-            'q':   'vscalesin_q', 
-            'oz':  'vscalesin_oz',  
-            'cw':  'vscalesin_cw', 
-        }         
-        
-        self.vscales_var_names = vscales_var_names
-        
-        # Loop over the variables to create a dictionary with xarrays for the vertical length scales
-        for var in vscales_var_names.items():
-            if var[0] == 'ps':
-                vscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat), order='F')
-                da_vscalesin_var = xr.DataArray(vscalesin_var, dims=['latitude'], coords={'latitude':self.lats})
-            elif var[0] == 'sst':
-                vscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlon), order='F')
-                da_vscalesin_var = xr.DataArray(vscalesin_var, dims=['latitude', 'longitude'], coords={'latitude':self.lats, 'longitude':self.lons})
-            else:
-                vscalesin_var = np.reshape(fobj[0][var[1]], (self.nlat, self.nlev), order='F')
-                da_vscalesin_var = xr.DataArray(vscalesin_var, dims=['latitude', 'level'], coords={'latitude':self.lats, 'level':self.levs})
-                da_vscalesin_var = da_vscalesin_var.transpose('level', 'latitude')
+        Result
+        ------
+            dictionary (read-only, see RecordStats in stats.py) with the 'min', 'max', 'mean', 'std' and 'nan' values
+            of the record (NaN values are ignored by the other statistics)
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            bfile.record_stats('hscales', 'sf')['max']
+        """
+        
+        da = getattr(self, kind)[var]
+        
+        cached = self._stats.get((kind, var))
+        
+        if cached is None or cached[0] is not da:
+            cached = (da, RecordStats(da))
+            self._stats[(kind, var)] = cached
+        
+        return cached[1]
+        
+    def stats(self):
+        """
+        stats
+        -----
+        
+        This method returns the statistics of all the records (see the record_stats method).
+        
+        Input parameters
+        ----------------
+            None.
+
+        Result
+        ------
+            dictionary with the kinds of records ('balprojs', 'amplitudes', 'hscales' and 'vscales') and, for each
+            kind, a dictionary with the statistics of the records of each variable
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
             
-            da_vscalesin_var = da_vscalesin_var.rename(var[1])
+            bfile.stats()['amplitudes']['sf']
+        """
+        
+        return {kind: {var: self.record_stats(kind, var) for var in getattr(self, kind)} 
+                for kind in ['balprojs', 'amplitudes', 'hscales', 'vscales']}
+        
+    def invalidate_stats(self):
+        """
+        invalidate_stats
+        ----------------
+        
+        This method discards the statistics kept by the record_stats method (and the factors of the B operator and
+        the eigenpairs of the vertical correlations kept by the apply_b and vertical_spectra methods); it must be 
+        called after changing the values of the records in place (eg., bfile.hscales['sf'][:] *= 1.2).
+        
+        Input parameters
+        ----------------
+            None.
+
+        Result
+        ------
+            None.
+        """
+        
+        self._stats = {}
+        self._operators = {}
+        self._vertical = {}
+        
+    def vertical_correlation(self, var):
+        """
+        vertical_correlation
+        --------------------
+        
+        This method returns the vertical correlation matrices (nlev x nlev) of a control variable for all the 
+        latitudes, built at once from the vertical length scales (grid units) with the Gaussian correlations used by
+        the apply_b method.
+        
+        Input parameters
+        ----------------
+            var: name of the control variable (eg., 'sf' or 't')
+
+        Result
+        ------
+            xarray DataArray with the dimensions (latitude, level, level_2)
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            bfile.vertical_correlation('t').sel(latitude=0, method='nearest').plot()
+        """
+        
+        return xr.DataArray(covariance.vertical_correlation(self.vscales[var].values), 
+                            dims=['latitude', 'level', 'level_2'], 
+                            coords={'latitude': self.lats, 'level': self.levs, 'level_2': self.levs},
+                            name='vcorr_' + str(var))
+        
+    def vertical_spectra(self, var=None):
+        """
+        vertical_spectra
+        ----------------
+        
+        This method returns the eigenvalues and the condition numbers (largest over smallest eigenvalue) of the 
+        vertical correlation matrices (see the vertical_correlation method) of all the latitudes. The 
+        eigendecompositions of all the latitudes of a variable are computed at once and kept (they are also used by
+        the apply_b method) until the vertical length scales are replaced (see the invalidate_stats method).
+        
+        Input parameters
+        ----------------
+            var: name of the control variable (eg., 'sf' or 't') or list of variables (default: all the variables 
+                 with vertical length scales)
+
+        Result
+        ------
+            xarray Dataset with the eigenvalues (eig_<var>, dimensions (latitude, mode), in ascending order), the 
+            eigenvectors (eigvec_<var>, dimensions (latitude, level, mode)) and the condition numbers (cond_<var>, 
+            dimension latitude) of each variable
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            spectra = bfile.vertical_spectra()
+            
+            spectra['cond_t'].max()
+        """
+        
+        if var is None:
+            var = list(self.vscales)
+        elif isinstance(var, str):
+            var = [var]
+        
+        modes = np.arange(1, self.nlev+1)
+        
+        data_vars = {}
+        
+        for v in var:
+            evals, evecs = self._vertical_eigen(v)
+            data_vars['eig_' + v] = (['latitude', 'mode'], evals)
+            data_vars['eigvec_' + v] = (['latitude', 'level', 'mode'], evecs)
+            data_vars['cond_' + v] = (['latitude'], covariance.condition_numbers(evals))
+        
+        return xr.Dataset(data_vars, coords={'latitude': self.lats, 'level': self.levs, 'mode': modes})
+        
+    def apply_b(self, var, field):
+        """
+        apply_b
+        -------
+        
+        This method applies an approximation of the background error covariance matrix of a control variable to a 
+        field (B x). The covariances are given by the amplitudes (S), the Gaussian vertical correlations (V) with the
+        vertical length scales (grid units) and the Gaussian horizontal correlations with the horizontal length scales
+        (m), split into zonal (Z, periodic, applied with FFTs) and meridional (M) correlations, as
+        B = S V^1/2 Z^1/2 M Z^1/2 V^1/2 S. The factors of the operator are computed once for each variable and kept 
+        until its records are replaced (see the invalidate_stats method). For sst, the horizontal length scales are 
+        averaged along the longitude. The factors and the result are in float32; the largest factors are the 
+        meridional correlations of each level (4*nlev*nlat**2 bytes, eg. about 1.2 GB at 1536 latitudes and 127 
+        levels).
+        
+        Input parameters
+        ----------------
+            var  : name of the control variable (eg., 'sf', 't', 'ps' or 'sst')
+            field: field with the dimensions (level, latitude, longitude), or (latitude, longitude) for ps and sst, 
+                   and any number of leading dimensions (eg., a batch of fields); numpy array or xarray DataArray
+
+        Result
+        ------
+            B x (float32), with the same shape (and type) of the field
+                    
+        Use
+        ---
+            import numpy as np
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            x = np.random.randn(10, bfile.nlev, bfile.nlat, bfile.nlon)
+            
+            bx = bfile.apply_b('t', x)
+        """
+        
+        return covariance.apply_b(self, var, field)
+        
+    def single_obs_test(self, var, lat, lon, lev=None, innov=1., oberr=1.):
+        """
+        single_obs_test
+        ---------------
+        
+        This method returns the analysis increment of a single (pseudo) observation of a control variable, as in the
+        single observation test of the GSI, with the B operator of the apply_b method: 
+        B H^T (H B H^T + R)^-1 (y - H x). The observation is placed at the nearest grid point.
+        
+        Input parameters
+        ----------------
+            var  : name of the control variable (eg., 'sf', 't', 'ps' or 'sst')
+            lat  : latitude of the observation
+            lon  : longitude of the observation
+            lev  : level of the observation (not used for ps and sst)
+            innov: innovation (observation minus background) (default: 1.)
+            oberr: standard deviation of the observation error (default: 1.)
+
+        Result
+        ------
+            xarray DataArray with the increment (dimensions (level, latitude, longitude), or (latitude, longitude) for
+            ps and sst)
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            inc = bfile.single_obs_test('t', lat=-23., lon=314., lev=10)
+            
+            inc.sel(level=10).plot()
+        """
+        
+        return covariance.single_obs_increment(self, var, lat, lon, lev=lev, innov=innov, oberr=oberr)
+        
+    def balance(self, sf):
+        """
+        balance
+        -------
+        
+        This method applies the balance operator given by the regression coefficients (balprojs) to a batch of 
+        stream function fields and returns the balanced parts of the temperature (agvin), velocity potential (bgvin)
+        and surface pressure (wgvin), as in the GSI. The whole batch is given by a single matrix product for each 
+        latitude (no loops over the levels or the fields).
+        
+        Input parameters
+        ----------------
+            sf: stream function, numpy array with the dimensions (..., level, latitude, longitude), where ... are any
+                number of batch dimensions (eg., the members of an ensemble), or xarray DataArray with the level, 
+                latitude and longitude dimensions (in any order) and any other dimensions
+
+        Result
+        ------
+            dictionary with the balanced 't', 'vp' and 'ps' (without the level dimension), as numpy arrays or xarray
+            DataArrays (with the batch dimensions first)
+                    
+        Use
+        ---
+            import numpy as np
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            sf = np.random.randn(20, bfile.nlev, bfile.nlat, bfile.nlon)
+            
+            bal = bfile.balance(sf)
+            
+            bal['t'].shape
+        """
+        
+        if isinstance(sf, xr.DataArray):
+            return balance.apply_balance_dataarray(self, sf)
+        
+        return balance.apply_balance(self, sf)
+        
+    # This method returns the factors of the B operator of a control variable (see the covariance module), computed
+    # once and kept until the records of the variable are replaced
+    def _operator_factors(self, var):
+        
+        recs = (self.amplitudes[var], self.hscales[var], self.vscales.get(var))
+        
+        cached = self._operators.get(var)
+        
+        if cached is None or any(a is not b for a, b in zip(cached[0], recs)):
+            cached = (recs, covariance.operator_factors(self, var))
+            self._operators[var] = cached
+        
+        return cached[1]
+        
+    # This method returns the eigenvalues and eigenvectors of the vertical correlations of a control variable (for all
+    # the latitudes), computed once and kept until the vertical length scales of the variable are replaced
+    def _vertical_eigen(self, var):
+        
+        da = self.vscales[var]
+        
+        cached = self._vertical.get(var)
+        
+        if cached is None or cached[0] is not da:
+            cached = (da, covariance.vertical_eigen(da.values))
+            self._vertical[var] = cached
+        
+        return cached[1]
+        
+    def regrid(self, nlat=None, nlon=None, nlev=None, lats=None, lons=None, levs=None):
+        """
+        regrid
+        ------
+        
+        This method interpolates (linearly) all the records of the background error covariance matrix to a new grid
+        and returns a new Berror object with the interpolated records. The new grid is given by the number of points 
+        (regularly spaced, as in the read_records method) or by the coordinates of the points. The weights of the 
+        interpolation are computed once for each pair of grids (and kept for the next calls) and the records with the
+        same dimensions are interpolated at once. The vertical length scales (in grid units) are stretched by the ratio
+        between the new and old spacing of the levels and the level_2 index of agvin (that multiplies the stream 
+        function) uses the pseudo-inverse of the vertical interpolation, so that the new regression coefficients applied 
+        to the interpolated stream function give the interpolated balanced part.
+        
+        Input parameters
+        ----------------
+            nlat: number of latitude points of the new grid (default: the same as the matrix)
+            nlon: number of longitude points of the new grid (default: the same as the matrix)
+            nlev: number of vertical levels of the new grid (the levels are regularly spaced between the first and
+                  the last levels of the matrix) (default: the same as the matrix)
+            lats: latitudes of the new grid, instead of nlat (-90 to 90)
+            lons: longitudes of the new grid, instead of nlon (0 to 360)
+            levs: positions of the new levels, instead of nlev, in units of the levels of the matrix (eg., 1.5 is 
+                  between the levels 1 and 2)
+
+        Result
+        ------
+            Berror object with the interpolated records, with the latitudes and longitudes of the new grid (lats and 
+            lons) and the levels numbered from 1 to the number of new levels (as in the files); since the .gcv files 
+            have no coordinates, a file written by to_gcv is read back with regularly spaced latitudes and longitudes
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            bfile_l64 = bfile.regrid(nlev=64)
+            
+            bfile_l64.to_gcv('arquivo_matriz_B_l64.gcv')
+        """
+        
+        if lats is None:
+            lats = np.linspace(-90,90, self.nlat if nlat is None else nlat)
+        
+        if lons is None:
+            lons = np.linspace(0,360, self.nlon if nlon is None else nlon)
+        
+        if levs is None:
+            levs = np.linspace(1, self.nlev, self.nlev if nlev is None else nlev)
+        
+        return regrid.regrid_records(self, lats, lons, levs)
+        
+    def to_netcdf(self, file_name, complevel=4):
+        """
+        to_netcdf
+        ---------
+        
+        This method writes all the records of the background error covariance matrix to a single NetCDF4 file, with 
+        shared latitude, longitude and level coordinates, compression (zlib) and chunks (agvin is chunked by level).
+        The file can be read back lazily with the open_store function.
+        
+        Input parameters
+        ----------------
+            file_name: name of the NetCDF4 file
+            complevel: compression level, from 1 to 9 (default: 4)
+
+        Result
+        ------
+            None.
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            bfile.to_netcdf('arquivo_matriz_B.nc')
+            
+            bfile_nc = gb.open_store('arquivo_matriz_B.nc')
+            
+            bfile_nc.amplitudes['sf']
+        """
+        
+        store.to_netcdf(self, file_name, complevel=complevel)
+        
+    def to_zarr(self, store_name, mode='w'):
+        """
+        to_zarr
+        -------
+        
+        This method writes all the records of the background error covariance matrix to a Zarr store, with shared
+        latitude, longitude and level coordinates, compression (default compressor of Zarr) and chunks (agvin is 
+        chunked by level). The store can be read back lazily with the open_store function.
+        
+        Input parameters
+        ----------------
+            store_name: name of the Zarr store (eg., a directory ending with .zarr)
+            mode      : writing mode, as in xarray's 'to_zarr()' method (default: 'w')
+
+        Result
+        ------
+            None.
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            bfile.to_zarr('arquivo_matriz_B.zarr')
+            
+            bfile_zarr = gb.open_store('arquivo_matriz_B.zarr')
+        """
+        
+        store.to_zarr(self, store_name, mode=mode)
+        
+    def to_dataset(self):
+        """
+        to_dataset
+        ----------
+        
+        This method returns a xarray dataset with all the records of the background error covariance matrix (named as
+        in the file, eg. 'corzin_sf' or 'agvin'), with the latitude, longitude and level coordinates (and their indexes)
+        shared by all the records. The dataset is built once by the read_records method and the amplitudes, hscales, 
+        vscales and balprojs dictionaries are views into it (the same values, not copies); if the dictionaries were 
+        changed (eg., a record replaced), the dataset is built again from them and the dictionaries become views into
+        the new dataset. Each record has the name of the variable ('var') and the kind of the record ('kind') as 
+        attributes, and the dataset has the dimensions ('nlat', 'nlon' and 'nlev') and the number of levels of each
+        control variable ('sig_' + var) as attributes.
+        
+        Input parameters
+        ----------------
+            None.
+
+        Result
+        ------
+            ds: xarray dataset with the records
+                    
+        Use
+        ---
+            import gsiberror as gb
+        
+            bfile = gb.Berror('arquivo_matriz_B.gcv')
+        
+            bfile.read_records()
+            
+            ds = bfile.to_dataset()
+            
+            ds.max()
+            
+            ds['corzin_sf'].variable is bfile.amplitudes['sf'].variable   # True (the same values)
+        """
+        
+        ds = getattr(self, '_dataset', None)
+        
+        dicts = [getattr(self, kind, {}) for kind in ['balprojs', 'amplitudes', 'hscales', 'vscales']]
+        
+        # The dataset is kept while the dictionaries are views into it
+        if ds is not None and len(ds.data_vars) == sum(len(recs) for recs in dicts) and \
+           all(ds.variables.get(da.name) is da.variable for recs in dicts for da in recs.values()):
+            return ds
+        
+        data_vars = {}
+        
+        for kind, recs in zip(['balprojs', 'amplitudes', 'hscales', 'vscales'], dicts):
+            for var, da in recs.items():
+                data_vars[da.name] = da.assign_attrs(var=var, kind=kind)
+        
+        ds = xr.Dataset(data_vars, attrs={'nlat': int(self.nlat), 'nlon': int(self.nlon), 'nlev': int(self.nlev)})
+        
+        for var, isig in getattr(self, 'sigs', {}).items():
+            ds.attrs['sig_' + var] = int(isig)
+        
+        for recs in dicts:
+            for var, da in recs.items():
+                recs[var] = ds[da.name]
+        
+        self._dataset = ds
+        
+        return ds
+    
+    # This method fills the attributes and records dictionaries (views into the dataset) from a xarray dataset written
+    # by to_dataset
+    def _from_dataset(self, ds):
+        
+        self._set_grid(int(ds.attrs['nlev']), int(ds.attrs['nlat']), int(ds.attrs['nlon']))
+        
+        self.sigs = {key[4:]: int(value) for key, value in ds.attrs.items() if key.startswith('sig_')}
+        
+        self._stats = {}
+        
+        self.balprojs = {}
+        self.amplitudes = {}
+        self.hscales = {}
+        self.vscales = {}
+        
+        for name in ds.data_vars:
+            getattr(self, ds[name].attrs['kind'])[ds[name].attrs['var']] = ds[name]
+        
+        self.amplitudes_names = {var: da.name for var, da in self.amplitudes.items()}
+        self.hscales_var_names = {var: da.name for var, da in self.hscales.items()}
+        self.vscales_var_names = {var: da.name for var, da in self.vscales.items()}
+        
+        self._dataset = ds
+        
+    # This method defines the dimensions and the coordinates of the grid; the latitudes and longitudes are regularly
+    # spaced (as in the files) unless they are given (eg., by the regrid method)
+    def _set_grid(self, nlev, nlat, nlon, lats=None, lons=None):
+        
+        self.nlat = nlat
+        self.nlon = nlon
+        self.nlev = nlev
+    
+        self.lats = np.linspace(-90,90, self.nlat) if lats is None else np.asarray(lats, dtype=np.float64)
+        self.lons = np.linspace(0,360, self.nlon) if lons is None else np.asarray(lons, dtype=np.float64)
+        self.levs = np.arange(1, self.nlev+1)
+        
+        # Coordinates (and their indexes) shared by all the records
+        self._coords = xr.Coordinates({'latitude': self.lats, 'longitude': self.lons, 'level': self.levs, 
+                                       'level_2': self.levs})
+        
+    # This method creates a xarray dataset with the records given as a list of (var, kind, data), where data is a flat
+    # array in the Fortran order; the records are views of the arrays (reshaped and transposed), with the coordinates
+    # of the grid
+    def _records_dataset(self, recs):
+        
+        data_vars = {}
+        
+        for var, kind, data in recs:
+            dims, axes = records.record_dims(var)
+            with profiling.stage('reshape'):
+                rec = np.reshape(data, records.record_shape(var, self.nlat, self.nlon, self.nlev), order='F')
+            data_vars[record_name(var, kind)] = xr.Variable(dims, rec.transpose(axes), attrs={'var': var, 'kind': kind})
+        
+        ds = xr.Dataset(data_vars, coords=self._coords, 
+                        attrs={'nlat': int(self.nlat), 'nlon': int(self.nlon), 'nlev': int(self.nlev)})
+        
+        for var, isig in getattr(self, 'sigs', {}).items():
+            ds.attrs['sig_' + var] = int(isig)
+        
+        return ds
+        
+    # This method creates the xarray for a record (given as a flat array in the Fortran order) of a given kind
+    def _record_dataarray(self, var, kind, data):
         
-            vscales[var[0]] = da_vscalesin_var
+        return self._records_dataset([(var, kind, data)])[record_name(var, kind)]
 
 #    @property
     def my_name(self, name):
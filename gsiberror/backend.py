@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+import os
+import numpy as np
+import xarray as xr
+
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+
+from .index import load_index
+from .records import record_dims
+
+# Array of a record of a .gcv file, which is only read (from a memory map of the file) for the indexed values
+class GcvBackendArray(BackendArray):
+
+    def __init__(self, file_name, entry):
+        self.file_name = file_name
+        self.entry = entry
+        self.axes = record_dims(entry['var'])[1]
+        self.shape = tuple(entry['shape'][i] for i in self.axes)
+        self.dtype = np.dtype(entry['dtype']).newbyteorder('=')
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method)
+
+    def _raw_indexing_method(self, key):
+        data = np.memmap(self.file_name, dtype=self.entry['dtype'], mode='r', offset=self.entry['offset'],
+                         shape=tuple(self.entry['shape']), order='F')
+
+        # Only the indexed values are read from the file (and converted to the native byte order)
+        return np.asarray(data.transpose(self.axes)[key], dtype=self.dtype)
+
+# Entry point for the xarray backend, which allows to open the .gcv files with xr.open_dataset(file_name, engine='gsiberror')
+class GSIBerrorBackendEntrypoint(BackendEntrypoint):
+
+    open_dataset_parameters = ['filename_or_obj', 'drop_variables', 'cache_index']
+
+    description = 'Open the GSI background error covariance matrices (.gcv format) in xarray'
+
+    url = 'https://github.com/GAD-DIMNT-CPTEC/GSIBerror'
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None, cache_index=True):
+
+        file_name = os.fspath(filename_or_obj)
+
+        fidx = load_index(file_name, cache=cache_index)
+
+        nlev, nlat, nlon = fidx['grid']
+
+        coords = {'latitude': np.linspace(-90,90, nlat),
+                  'longitude': np.linspace(0,360, nlon),
+                  'level': np.arange(1, nlev+1),
+                  'level_2': np.arange(1, nlev+1)}
+
+        drop_variables = drop_variables or []
+
+        data_vars = {}
+
+        for entry in fidx['records']:
+
+            if entry['name'] in drop_variables:
+                continue
+
+            data = indexing.LazilyIndexedArray(GcvBackendArray(file_name, entry))
+
+            attrs = {'var': entry['var'], 'kind': entry['kind']}
+
+            data_vars[entry['name']] = xr.Variable(record_dims(entry['var'])[0], data, attrs=attrs)
+
+        ds = xr.Dataset(data_vars, coords=coords, attrs={'nlat': nlat, 'nlon': nlon, 'nlev': nlev})
+
+        for var, isig in fidx['sigs'].items():
+            ds.attrs['sig_' + var] = isig
+
+        ds.encoding['source'] = file_name
+
+        return ds
+
+    def guess_can_open(self, filename_or_obj):
+
+        try:
+            return os.path.splitext(os.fspath(filename_or_obj))[1] == '.gcv'
+        except TypeError:
+            return False
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import xarray as xr
+
+# This function returns the balance coefficients of a Berror object in double precision: agvin with the dimensions
+# (latitude, level, level_2) and bgvin and wgvin with the dimensions (level, latitude)
+def balance_coeffs(bfile):
+
+    agvin = np.asarray(bfile.balprojs['agvin'].transpose('latitude', 'level', 'level_2').values, dtype=np.float64)
+    bgvin = np.asarray(bfile.balprojs['bgvin'].transpose('level', 'latitude').values, dtype=np.float64)
+    wgvin = np.asarray(bfile.balprojs['wgvin'].transpose('level', 'latitude').values, dtype=np.float64)
+
+    return agvin, bgvin, wgvin
+
+# This function applies the balance operator to a batch of stream function fields with the dimensions (..., level,
+# latitude, longitude) and returns the balanced temperature, velocity potential and surface pressure, as in the GSI:
+#
+#     t(k,j)  = sum_l agvin(j,k,l)*sf(l,j)
+#     vp(k,j) = bgvin(j,k)*sf(k,j)
+#     ps(j)   = sum_l wgvin(j,l)*sf(l,j)
+#
+# The leading (batch) dimensions and the longitude are stacked, so that temperature and surface pressure are given by
+# a single matrix product for each latitude (a batched matmul over latitude)
+def apply_balance(bfile, sf):
+
+    agvin, bgvin, wgvin = balance_coeffs(bfile)
+
+    sf = np.asarray(sf, dtype=np.float64)
+
+    if sf.ndim < 3:
+        raise ValueError('The stream function must have the dimensions (..., level, latitude, longitude)')
+
+    nlev, nlat, nlon = sf.shape[-3:]
+    batch = sf.shape[:-3]
+
+    # (..., level, latitude, longitude) -> (latitude, level, samples)
+    sfl = sf.reshape((-1, nlev, nlat, nlon)).transpose(2, 1, 0, 3).reshape((nlat, nlev, -1))
+
+    t = np.matmul(agvin, sfl)
+    ps = np.matmul(wgvin.T[:, None, :], sfl)
+
+    # (latitude, level, samples) -> (..., level, latitude, longitude)
+    def unstack(field):
+        nk = field.shape[1]
+        return field.reshape((nlat, nk, -1, nlon)).transpose(2, 1, 0, 3).reshape(batch + (nk, nlat, nlon))
+
+    return {'t': unstack(t), 'vp': sf * bgvin[:, :, None], 'ps': unstack(ps)[..., 0, :, :]}
+
+# This function applies the balance operator to a stream function given as a xarray DataArray (with the dimensions
+# level, latitude and longitude, in any order, and any other dimensions) and returns a dictionary of DataArrays
+def apply_balance_dataarray(bfile, sf):
+
+    batch_dims = [dim for dim in sf.dims if dim not in ('level', 'latitude', 'longitude')]
+
+    sf = sf.transpose(*batch_dims, 'level', 'latitude', 'longitude')
+
+    bal = apply_balance(bfile, sf.values)
+
+    coords = {name: coord for name, coord in sf.coords.items()}
+
+    return {'t': xr.DataArray(bal['t'], dims=sf.dims, coords=coords, name='balanced_t'),
+            'vp': xr.DataArray(bal['vp'], dims=sf.dims, coords=coords, name='balanced_vp'),
+            'ps': xr.DataArray(bal['ps'], dims=sf.dims[:-3] + sf.dims[-2:], name='balanced_ps',
+                               coords={name: coord for name, coord in coords.items() if 'level' not in coord.dims})}
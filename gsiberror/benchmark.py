@@ -0,0 +1,303 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from .records import amplitudes_names, hscales_var_names, vscales_var_names, balprojs_names, control_vars
+from .records import detect_layout, layout_dtype
+
+# Resolutions of the synthetic matrices (nlat, nlon, nlev), from T62 with 28 levels to about 1536 latitudes with
+# 127 levels
+resolutions = {
+    't62l28':   (96, 192, 28),
+    't126l64':  (192, 384, 64),
+    't254l64':  (386, 768, 64),
+    't574l64':  (578, 1152, 64),
+    't1534l127': (1536, 3072, 127),
+}
+
+# Names of the benchmarks, in the order they are run
+benchmark_names = ['read_records', 'read_records_lazy', 'read_records_native', 'decode', 'dataarrays',
+                   'global_minmax', 'plot_reg_coeffs', 'plot_amplitudes', 'plot_hscales', 'plot_vscales']
+
+# This function returns a Berror object with synthetic (random but realistic) records: positive amplitudes,
+# horizontal length scales between 100 and 600 km and vertical length scales between 0.5 and 3 grid units
+def synthetic_berror(nlat, nlon, nlev, seed=0):
+
+    from . import Berror
+
+    rng = np.random.default_rng(seed)
+
+    bfile = Berror('synthetic')
+
+    bfile._set_grid(nlev, nlat, nlon)
+
+    bfile.sigs = {var: (1 if var in ('ps', 'sst') else nlev) for var in control_vars}
+
+    # This function returns the flat (Fortran order) values of a record, with a smooth variation in latitude and
+    # level plus noise
+    def values(var, low, high):
+        shape = (nlat, nlon) if var == 'sst' else (nlat,) if var == 'ps' else (nlat, nlev)
+        smooth = 0.5 + 0.5*np.cos(np.radians(bfile.lats)).reshape((nlat,) + (1,)*(len(shape) - 1))
+        field = smooth * (0.8 + 0.2*rng.random(shape, dtype=np.float32))
+        return (low + (high - low)*field).astype(np.float32).ravel(order='F')
+
+    bfile.balprojs = {}
+    bfile.balprojs['agvin'] = bfile._record_dataarray('agvin', 'balprojs',
+                                                      (0.01*rng.standard_normal(nlat*nlev*nlev)).astype(np.float32))
+    bfile.balprojs['bgvin'] = bfile._record_dataarray('bgvin', 'balprojs', values('bgvin', 0., 0.5))
+    bfile.balprojs['wgvin'] = bfile._record_dataarray('wgvin', 'balprojs', values('wgvin', -1e-3, 1e-3))
+
+    bfile.amplitudes = {var: bfile._record_dataarray(var, 'amplitudes', values(var, 0.1, 10.)) for var in amplitudes_names}
+    bfile.hscales = {var: bfile._record_dataarray(var, 'hscales', values(var, 1e5, 6e5)) for var in hscales_var_names}
+    bfile.vscales = {var: bfile._record_dataarray(var, 'vscales', values(var, 0.5, 3.)) for var in vscales_var_names}
+
+    bfile.amplitudes_names = dict(amplitudes_names)
+    bfile.hscales_var_names = dict(hscales_var_names)
+    bfile.vscales_var_names = dict(vscales_var_names)
+
+    return bfile
+
+# This function writes a synthetic .gcv file (see synthetic_berror) and returns its name
+def write_synthetic(file_name, nlat, nlon, nlev, seed=0):
+
+    synthetic_berror(nlat, nlon, nlev, seed=seed).to_gcv(file_name)
+
+    return file_name
+
+# This function runs a function (after its setup, which is not measured) and returns the best wall time of the runs
+# and the peak of memory allocated (by python and numpy) in a separate run, with tracemalloc; the function is run once
+# before the timed runs (not measured), so that the one-time setup of the modules (eg., xarray and pandas) is excluded
+def measure(func, setup=None, repeat=1):
+
+    args = setup() if setup is not None else ()
+    func(*args)
+
+    times = []
+
+    for i in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup is not None else ()
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'time': min(times), 'peak_mb': peak / 2**20}
+
+# This function returns the functions (and their setup functions) of the benchmarks of a .gcv file
+def benchmark_tasks(file_name, outdir):
+
+    import matplotlib.pyplot as plt
+
+    from . import Berror
+    from . import plot_functions
+
+    # Matrix (with the records read) used by the benchmarks of the statistics and plots
+    def read_matrix():
+        bfile = Berror(file_name)
+        bfile.read_records()
+        bfile.my_name(os.path.basename(file_name))
+        return (bfile,)
+
+    def read_records(**kwargs):
+        bfile = Berror(file_name)
+        bfile.read_records(**kwargs)
+
+    # Layout of the file (see detect_layout in records.py) and structure of its records
+    with open(file_name, 'rb') as fobj:
+        layout, (nlev, nlat, nlon) = detect_layout(fobj)
+
+    dt_obj = layout_dtype(nlat, nlon, nlev, layout)
+
+    # Decoding of the file (the structured read of all the records)
+    def decode():
+        with open(file_name, 'rb') as fobj:
+            fobj.seek(layout.marker)
+            fields = np.fromfile(fobj, dtype=dt_obj, count=-1)
+        if fields.size != 1:
+            raise ValueError('The size of ' + str(file_name) + ' is not the one given by its header and layout')
+        return fields
+
+    def decoded():
+        fields = decode()[0]
+        bfile = Berror(file_name)
+        bfile._set_grid(*(int(n) for n in fields['grid']))
+        return bfile, fields
+
+    # Construction of the dataset with all the records (from the decoded file) and of the DataArrays of the
+    # dictionaries (views into the dataset)
+    def dataarrays(bfile, fields):
+        recs = [(var, 'balprojs', fields[var]) for var in balprojs_names]
+        for names, kind in [(amplitudes_names, 'amplitudes'), (hscales_var_names, 'hscales'), (vscales_var_names, 'vscales')]:
+            recs.extend((var, kind, fields[name]) for var, name in names.items() if name in dt_obj.names)
+        ds = bfile._records_dataset(recs)
+        return [ds[name] for name in ds.data_vars]
+
+    # Statistics of all the records (the statistics kept by the matrix are discarded before each run)
+    def fresh_matrix():
+        bfile = read_matrix()[0]
+        bfile.invalidate_stats()
+        return (bfile,)
+
+    def global_minmax(bfile):
+        for kind in ['balprojs', 'amplitudes', 'hscales', 'vscales']:
+            for var in getattr(bfile, kind):
+                plot_functions.global_minmax([bfile], kind, var)
+
+    # Plots (saved in the output directory)
+    def plot(name, *args):
+        def func(bfile):
+            getattr(plot_functions, name)([bfile], *args, savefig=True, suptitle=True,
+                                          figname=os.path.join(outdir, name + '.png'))
+            plt.close('all')
+        return func
+
+    return {
+        'read_records':        (lambda: read_records(), None),
+        'read_records_lazy':   (lambda: read_records(lazy=True), None),
+        'read_records_native': (lambda: read_records(native=True), None),
+        'decode':              (decode, None),
+        'dataarrays':          (dataarrays, decoded),
+        'global_minmax':       (global_minmax, fresh_matrix),
+        'plot_reg_coeffs':     (plot('plot_reg_coeffs', 'agvin', 0), read_matrix),
+        'plot_amplitudes':     (plot('plot_amplitudes', 'sf'), read_matrix),
+        'plot_hscales':        (plot('plot_hscales', 'sf'), read_matrix),
+        'plot_vscales':        (plot('plot_vscales', 'sf'), read_matrix),
+    }
+
+def run_benchmarks(names=None, benchmarks=None, repeat=1, workdir=None, file_names=None):
+    """
+    run_benchmarks
+    --------------
+
+    This function measures the wall time (best of the runs) and the peak of memory allocated (with tracemalloc) by
+    reading (read_records, in the default, lazy and native modes, and its stages: the decoding of the file and the
+    construction of the DataArrays), by global_minmax (for all the records) and by each plot function, for synthetic
+    .gcv files at a range of resolutions (see the resolutions dictionary) or for given files.
+
+    Input parameters
+    ----------------
+        names     : list with the names of the resolutions (default: all the resolutions)
+        benchmarks: list with the names of the benchmarks (default: all the benchmarks, see benchmark_names)
+        repeat    : number of runs of each benchmark used for the wall time, after an untimed run (default: 1)
+        workdir   : directory for the synthetic files and the figures (default: a temporary directory, removed
+                    at the end)
+        file_names: list of .gcv files measured instead of the synthetic files (default: None)
+
+    Result
+    ------
+        list with a dictionary for each benchmark and file, with the name of the file ('file'), the resolution
+        ('nlat', 'nlon', 'nlev'), the benchmark ('benchmark'), the wall time in seconds ('time') and the peak of
+        memory in MiB ('peak_mb')
+
+    Use
+    ---
+        import gsiberror.benchmark as gbb
+
+        results = gbb.run_benchmarks(names=['t62l28'], benchmarks=['read_records', 'global_minmax'])
+
+    or, from the command line:
+
+        python -m gsiberror.benchmark --resolutions t62l28 t254l64 --json results.json
+    """
+
+    if benchmarks is None:
+        benchmarks = benchmark_names
+
+    tmpdir = workdir is None
+
+    if tmpdir:
+        workdir = tempfile.mkdtemp(prefix='gsiberror_benchmark_')
+
+    os.makedirs(workdir, exist_ok=True)
+
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend('Agg')
+
+    results = []
+
+    try:
+        if file_names is None:
+            if names is None:
+                names = list(resolutions)
+            file_names = []
+            for name in names:
+                nlat, nlon, nlev = resolutions[name]
+                file_name = os.path.join(workdir, 'synthetic_' + name + '.gcv')
+                if not os.path.exists(file_name):
+                    write_synthetic(file_name, nlat, nlon, nlev)
+                file_names.append(file_name)
+
+        for file_name in file_names:
+
+            with open(file_name, 'rb') as fobj:
+                nlev, nlat, nlon = detect_layout(fobj)[1]
+
+            tasks = benchmark_tasks(file_name, workdir)
+
+            for benchmark in benchmarks:
+                func, setup = tasks[benchmark]
+                res = measure(func, setup, repeat=repeat)
+                results.append(dict(file=os.path.basename(file_name), nlat=nlat, nlon=nlon, nlev=nlev,
+                                    benchmark=benchmark, **res))
+    finally:
+        if tmpdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+# This function prints the results of the benchmarks as a table
+def print_results(results, file=sys.stdout):
+
+    print('{:<28s} {:>16s} {:<20s} {:>10s} {:>12s}'.format('file', 'nlat x nlon x nlev', 'benchmark', 'time (s)',
+                                                           'peak (MiB)'), file=file)
+
+    for res in results:
+        grid = str(res['nlat']) + 'x' + str(res['nlon']) + 'x' + str(res['nlev'])
+        print('{:<28s} {:>16s} {:<20s} {:>10.3f} {:>12.1f}'.format(res['file'], grid, res['benchmark'], res['time'],
+                                                                   res['peak_mb']), file=file)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m gsiberror.benchmark',
+                                     description='Wall time and peak memory of reading and plotting .gcv files')
+
+    parser.add_argument('files', nargs='*', help='.gcv files (default: synthetic files at the given resolutions)')
+    parser.add_argument('--resolutions', nargs='+', choices=list(resolutions), default=None,
+                        help='resolutions of the synthetic files (default: all)')
+    parser.add_argument('--benchmarks', nargs='+', choices=benchmark_names, default=None,
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='number of timed runs of each benchmark, after an untimed run (default: 1)')
+    parser.add_argument('--workdir', default=None, help='directory for the synthetic files and the figures ' +
+                        '(default: a temporary directory)')
+    parser.add_argument('--json', default=None, help='file to save the results (json)')
+
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(names=args.resolutions, benchmarks=args.benchmarks, repeat=args.repeat,
+                             workdir=args.workdir, file_names=args.files or None)
+
+    print_results(results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as fobj:
+            json.dump(results, fobj, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+
+import os
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .records import control_vars, layout_dtype, layout_dtypes, detect_layout, scan_records
+
+# This function checks the length scales of a record (read from the file with a small read at its byte offset) and
+# returns the list of problems found (NaN or non-positive values)
+def check_scales(fobj, var, kind, offset, size, dtype='>f4'):
+
+    fobj.seek(offset)
+
+    values = np.fromfile(fobj, dtype=dtype, count=size)
+
+    problems = []
+
+    nnan = int(np.count_nonzero(np.isnan(values)))
+    if nnan:
+        problems.append(str(nnan) + ' NaN values in the ' + kind + ' of ' + repr(var))
+
+    nneg = int(np.count_nonzero(values <= 0))
+    if nneg:
+        problems.append(str(nneg) + ' non-positive values in the ' + kind + ' of ' + repr(var))
+
+    return problems
+
+def validate(file_name, check_values=True):
+    """
+    validate
+    --------
+
+    This function checks the structure of a .gcv file without reading the whole file: the record markers (the leading
+    and trailing markers of each record must match), the dimensions of the header (the size of the file must be the
+    one given by nlev, nlat and nlon), the sizes of the records, the order of the control variables (sf, vp, t, q,
+    oz, cw, ps and sst; some of them may be missing, eg. oz and cw) and (optionally) the values of the horizontal and
+    vertical length scales (NaN or non-positive values). The layout of the file (byte order, sizes of the record 
+    markers and of the reals) is detected from its first records. The records are skipped with seeks and only the 
+    markers, the header, the tags and the length scales are read.
+
+    Input parameters
+    ----------------
+        file_name   : name of the file
+        check_values: if True, the length scales are checked for NaN and non-positive values (default: True)
+
+    Result
+    ------
+        dictionary with the name of the file ('file'), the layout of the file ('layout', see detect_layout in 
+        records.py, None if it can't be detected), the dimensions ('nlev', 'nlat' and 'nlon', None if the header
+        can't be read), the control variables in the order they were found ('vars'), the list of problems found
+        ('errors') and 'valid' (True if no problems were found)
+
+    Use
+    ---
+        import gsiberror as gb
+
+        res = gb.validate('arquivo_matriz_B.gcv')
+
+        if not res['valid']:
+            print(res['errors'])
+    """
+
+    file_name = os.fspath(file_name)
+
+    result = {'file': file_name, 'valid': False, 'layout': None, 'nlev': None, 'nlat': None, 'nlon': None, 'vars': [],
+              'errors': []}
+
+    errors = result['errors']
+
+    try:
+        fsize = os.path.getsize(file_name)
+    except OSError as err:
+        errors.append(str(err))
+        return result
+
+    scales = []
+
+    with open(file_name, 'rb') as fobj:
+
+        try:
+            layout = detect_layout(fobj)[0]
+        except ValueError as err:
+            errors.append(str(err))
+            return result
+
+        result['layout'] = layout
+
+        try:
+            for var, kind, offset, size, data in scan_records(fobj, read=False, layout=layout):
+                if kind == 'header':
+                    nlev, nlat, nlon = (int(n) for n in data[:3])
+                    result.update(nlev=nlev, nlat=nlat, nlon=nlon)
+                    if min(nlev, nlat, nlon) <= 0:
+                        raise ValueError('Invalid dimensions in the header: nlev, nlat, nlon = ' +
+                                         str((nlev, nlat, nlon)))
+                    expected = layout.marker + layout_dtype(nlat, nlon, nlev, layout).itemsize
+                    if fsize != expected:
+                        errors.append('The size of the file (' + str(fsize) + ' bytes) is different from the size' +
+                                      ' given by the header (' + str(expected) + ' bytes for nlev, nlat, nlon = ' +
+                                      str((nlev, nlat, nlon)) + ')')
+                elif kind == 'tag':
+                    result['vars'].append(var)
+                elif kind in ('hscales', 'vscales'):
+                    scales.append((var, kind, offset, size))
+        except ValueError as err:
+            errors.append(str(err))
+
+        # The control variables must be in the expected order (some of them may be missing) and can't be repeated
+        expected = [var for var in control_vars if var in result['vars']]
+
+        if result['vars'] != expected or len(set(result['vars'])) != len(result['vars']):
+            errors.append('The control variables are ' + str(result['vars']) + ' (expected: ' + str(control_vars) + ')')
+
+        if check_values:
+            for var, kind, offset, size in scales:
+                errors.extend(check_scales(fobj, var, kind, offset, size, layout_dtypes(layout)[2]))
+
+    result['valid'] = not errors
+
+    return result
+
+def validate_many(file_names, workers=None, check_values=True):
+    """
+    validate_many
+    -------------
+
+    This function checks the structure of several .gcv files (see the validate function) with a pool of threads.
+
+    Input parameters
+    ----------------
+        file_names  : list with the names of the files
+        workers     : number of threads (default: as in ThreadPoolExecutor)
+        check_values: if True, the length scales are checked for NaN and non-positive values (default: True)
+
+    Result
+    ------
+        list with the results of the validate function for each file (in the same order of the files)
+
+    Use
+    ---
+        import glob
+        import gsiberror as gb
+
+        bad = [res['file'] for res in gb.validate_many(glob.glob('matrizes/*.gcv')) if not res['valid']]
+    """
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda file_name: validate(file_name, check_values=check_values), file_names))
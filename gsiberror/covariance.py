@@ -0,0 +1,232 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import xarray as xr
+
+# Radius of the Earth (m), used to convert the horizontal length scales (m) into distances between grid points
+earth_radius = 6371220.
+
+# This function returns the (non-stationary) Gaussian correlation matrices between the points of a set of coordinates
+# with a length scale for each point; the scales may have leading dimensions (one matrix for each), eg. (nlev, nlat)
+# gives (nlev, nlat, nlat). With the same scale s for all the points, the correlation is exp(-d**2/(2*s**2)); with
+# different scales the matrices are kept symmetric and positive definite
+def gaussian_correlation(coords, scales):
+
+    coords = np.asarray(coords, dtype=np.float64)
+    scales = np.asarray(scales, dtype=np.float64)
+
+    s2 = scales[..., :, None]**2 + scales[..., None, :]**2
+    d2 = (coords[:, None] - coords[None, :])**2
+
+    return np.sqrt(2. * scales[..., :, None] * scales[..., None, :] / s2) * np.exp(-d2 / s2)
+
+# This function returns the vertical correlation matrices of a record of vertical length scales (grid units) with
+# the dimensions (level, latitude), as an array with the dimensions (latitude, level, level_2)
+def vertical_correlation(vscales):
+
+    vscales = np.asarray(vscales, dtype=np.float64)
+
+    return gaussian_correlation(np.arange(vscales.shape[0]), vscales.T)
+
+# This function returns the eigenvalues (in ascending order) and eigenvectors (columns) of the vertical correlation
+# matrices of all the latitudes, computed at once (batched eigendecomposition)
+def vertical_eigen(vscales):
+
+    return np.linalg.eigh(vertical_correlation(vscales))
+
+# This function returns the square root of a set of symmetric correlation matrices from their eigenvalues and
+# eigenvectors; the negative eigenvalues (from round off) are set to zero
+def eigen_sqrt(evals, evecs):
+
+    return np.einsum('...ik,...k,...jk->...ij', evecs, np.sqrt(np.clip(evals, 0., None)), evecs)
+
+# This function returns the condition numbers (largest over smallest eigenvalue) of a set of correlation matrices; the
+# singular matrices (smallest eigenvalue not positive) have infinite condition numbers
+def condition_numbers(evals):
+
+    evals = np.asarray(evals)
+
+    with np.errstate(divide='ignore'):
+        return np.where(evals[..., 0] > 0., evals[..., -1] / evals[..., 0], np.inf)
+
+# Tolerance of the spectra of the square root of the zonal correlations (relative to the largest value of each
+# spectrum): the wavenumbers above the last one where a spectrum exceeds it are dropped (see zonal_sqrt_spectra)
+spectra_tolerance = 1e-3
+
+# This function returns the spectra (along the longitude) of the square root of the zonal Gaussian correlations for
+# a set of length scales (in grid points) with the dimensions (level, latitude); the correlations are periodic 
+# (circulant) and their spectra are computed from the first row of the correlation matrices, one level at a time.
+# The spectra are kept in float32 and only up to the last wavenumber where a spectrum exceeds the tolerance (the
+# spectra of the Gaussian correlations decay quickly, eg. about a fifth of the wavenumbers are kept at 1536 x 3072
+# points with length scales of 100 to 300 km, with correlations within 3e-4 of the ones with all the wavenumbers)
+def zonal_sqrt_spectra(nlon, scales, tol=spectra_tolerance):
+
+    scales = np.asarray(scales, dtype=np.float64)
+
+    dist = np.arange(nlon)
+    dist = np.minimum(dist, nlon - dist)
+
+    spectra = []
+
+    for scale in scales:
+        kernel = np.exp(-dist**2 / (2. * scale[:, None]**2))
+        spec = np.sqrt(np.clip(np.fft.rfft(kernel, axis=-1).real, 0., None))
+        above = np.nonzero((spec > tol * spec.max(axis=-1, keepdims=True)).any(axis=0))[0]
+        spectra.append(spec[:, :above.max() + 1].astype(np.float32))
+
+    result = np.zeros((len(spectra), scales.shape[-1], max(spec.shape[-1] for spec in spectra)), dtype=np.float32)
+
+    for k, spec in enumerate(spectra):
+        result[k, :, :spec.shape[-1]] = spec
+
+    return result
+
+# This function applies the square root of the zonal correlations (given by their spectra, see zonal_sqrt_spectra)
+# to a field; the wavenumbers beyond the spectra are set to zero
+def apply_zonal(spectra, field):
+
+    nlon = field.shape[-1]
+
+    return np.fft.irfft(np.fft.rfft(field, axis=-1)[..., :spectra.shape[-1]] * spectra, n=nlon, axis=-1)
+
+# This function returns the factors of the B operator of a control variable of a Berror object: the amplitudes, the
+# square root of the vertical correlations (for each latitude), the meridional correlations (for each level) and the
+# spectra of the square root of the zonal correlations (for each level and latitude); the variables with a single
+# level (ps and sst) are given a level dimension of size 1 and no vertical correlations. The amplitudes are
+# normalized by the standard deviations of the correlation operator, so that the variances of B are the squares of
+# the amplitudes. The factors are kept in float32: the largest ones are the meridional correlations (4*nlev*nlat**2
+# bytes, about 1.2 GB at 1536 latitudes and 127 levels) and the zonal spectra (4*nlev*nlat bytes per wavenumber kept)
+def operator_factors(bfile, var):
+
+    nlat, nlon = int(bfile.nlat), int(bfile.nlon)
+
+    lats = np.radians(np.asarray(bfile.lats, dtype=np.float64))
+
+    amp = np.asarray(bfile.amplitudes[var].values, dtype=np.float64)
+    hscales = np.asarray(bfile.hscales[var].values, dtype=np.float64)
+
+    if var == 'ps':
+        amp = amp.reshape(1, nlat, 1)
+        hscales = hscales.reshape(1, nlat)
+    elif var == 'sst':
+        amp = amp.reshape(1, nlat, nlon)
+        # The zonal and meridional filters use a single length scale for each latitude (the zonal mean of the scales)
+        hscales = hscales.mean(axis=1).reshape(1, nlat)
+    else:
+        amp = amp[:, :, None]
+
+    if var in bfile.vscales:
+        vsqrt = eigen_sqrt(*bfile._vertical_eigen(var))
+    else:
+        vsqrt = None
+
+    # Meridional correlations, with the distances along the meridians (m), built one level at a time
+    mcorr = np.empty(hscales.shape + (nlat,), dtype=np.float32)
+
+    for k, scales in enumerate(hscales):
+        mcorr[k] = gaussian_correlation(earth_radius * lats, scales)
+
+    # Zonal correlations, with the length scales in grid points of each latitude circle
+    with np.errstate(divide='ignore'):
+        dx = earth_radius * np.abs(np.cos(lats)) * 2. * np.pi / nlon
+        zspectra = zonal_sqrt_spectra(nlon, np.where(dx > 1e-6 * earth_radius, hscales / dx, np.inf))
+
+    # Variances of the correlation operator (they depend on the level and latitude only): M only couples points of
+    # the same longitude and the zonal correlations are circulant, so the diagonal of Z^1/2 M Z^1/2 at latitude i is
+    # M_ii times the diagonal of the zonal correlations of latitude i (the sum of the squares of its spectra)
+    weights = np.full(zspectra.shape[-1], 2.)
+    weights[0] = 1.
+    if nlon % 2 == 0 and zspectra.shape[-1] == nlon // 2 + 1:
+        weights[-1] = 1.
+
+    variances = mcorr.diagonal(axis1=1, axis2=2) * (zspectra.astype(np.float64)**2 @ weights) / nlon
+
+    if vsqrt is not None:
+        variances = np.einsum('jkl,lj->kj', vsqrt**2, variances)
+
+    # The amplitudes are divided by the standard deviations of the correlation operator, so that it is normalized
+    # (a correlation of 1 at each point)
+    amp = amp / np.sqrt(variances)[:, :, None]
+
+    if vsqrt is not None:
+        vsqrt = vsqrt.astype(np.float32)
+
+    return {'amp': amp.astype(np.float32), 'vsqrt': vsqrt, 'mcorr': mcorr, 'zspectra': zspectra}
+
+# This function applies the B operator (given by its factors) to a field (float32) with the dimensions (level, 
+# latitude, longitude) and any number of leading dimensions (eg., a batch of fields); the operator is
+# B = S V^1/2 Z^1/2 M Z^1/2 V^1/2 S (S: amplitudes, V: vertical, Z: zonal and M: meridional correlations)
+def apply_factors(factors, field):
+
+    vsqrt = factors['vsqrt']
+
+    field = field * factors['amp']
+
+    # The products of matrices are computed by matmul (BLAS), with the latitudes as the batch dimension of the
+    # vertical correlations and the levels as the batch dimension of the meridional ones
+    if vsqrt is not None:
+        field = np.swapaxes(np.matmul(vsqrt, np.swapaxes(field, -3, -2)), -3, -2)
+
+    field = apply_zonal(factors['zspectra'], field)
+    field = np.matmul(factors['mcorr'], field)
+    field = apply_zonal(factors['zspectra'], field)
+
+    if vsqrt is not None:
+        field = np.swapaxes(np.matmul(vsqrt, np.swapaxes(field, -3, -2)), -3, -2)
+
+    return field * factors['amp']
+
+# This function returns the dimensions and coordinates of the fields of a control variable of a Berror object
+def field_coords(bfile, var):
+
+    if var in ('ps', 'sst'):
+        return ('latitude', 'longitude'), {'latitude': bfile.lats, 'longitude': bfile.lons}
+
+    return ('level', 'latitude', 'longitude'), {'level': bfile.levs, 'latitude': bfile.lats, 'longitude': bfile.lons}
+
+# This function applies the B operator of a control variable to a field (or a batch of fields), in float32
+def apply_b(bfile, var, field):
+
+    factors = bfile._operator_factors(var)
+
+    values = np.asarray(field, dtype=np.float32)
+
+    if var in ('ps', 'sst'):
+        result = apply_factors(factors, values[..., None, :, :])[..., 0, :, :]
+    else:
+        result = apply_factors(factors, values)
+
+    if isinstance(field, xr.DataArray):
+        return field.copy(data=result)
+
+    return result
+
+# This function returns the analysis increment of a single (pseudo) observation of a control variable, placed at the
+# nearest grid point of the given latitude, longitude and level
+def single_obs_increment(bfile, var, lat, lon, lev=None, innov=1., oberr=1.):
+
+    dims, coords = field_coords(bfile, var)
+
+    point = {'latitude': int(np.abs(np.asarray(bfile.lats) - lat).argmin()),
+             'longitude': int(np.abs((np.asarray(bfile.lons) - lon + 180.) % 360. - 180.).argmin())}
+
+    if 'level' in dims:
+        if lev is None:
+            raise ValueError('The level of the observation is required for ' + str(var))
+        point['level'] = int(np.abs(np.asarray(bfile.levs) - lev).argmin())
+
+    index = tuple(point[dim] for dim in dims)
+
+    delta = np.zeros([len(coords[dim]) for dim in dims])
+    delta[index] = 1.
+
+    # Column of B at the observation (B H^T) and its variance at the observation (H B H^T)
+    column = apply_b(bfile, var, delta)
+
+    increment = column * innov / (column[index] + oberr**2)
+
+    return xr.DataArray(increment.astype(np.float32), dims=dims, coords=coords, name='increment_' + str(var),
+                        attrs={'latitude': float(bfile.lats[point['latitude']]),
+                               'longitude': float(bfile.lons[point['longitude']]),
+                               'level': float(bfile.levs[point['level']]) if 'level' in point else np.nan,
+                               'innov': float(innov), 'oberr': float(oberr)})
@@ -0,0 +1,214 @@
+#! /usr/bin/env python3
+
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from . import records
+
+# Names of the statistics computed by ensemble_stats
+ensemble_stats_names = ['mean', 'std', 'var', 'min', 'max']
+
+# This function returns an empty accumulator of the statistics of a set of matrices: the grid and the number of
+# levels of each variable (checked against each new file), the number of files and, for each record (kind, var), the
+# mean, the sum of the squared deviations from the mean (m2), the minimum and the maximum
+def new_accumulator():
+
+    return {'grid': None, 'sigs': {}, 'count': 0, 'records': {}}
+
+# This function adds the records of a .gcv file to an accumulator (Welford's update of the mean and m2); the records
+# are read one at a time, so that only one record of the file is kept in memory
+def accumulate_file(acc, file_name):
+
+    recs = records.iter_records(file_name)
+
+    grid = tuple(int(n) for n in next(recs)[2][:3])
+
+    if acc['grid'] is None:
+        acc['grid'] = grid
+    elif acc['grid'] != grid:
+        raise ValueError('The dimensions of ' + str(file_name) + ' (nlev, nlat, nlon = ' + str(grid) +
+                         ') are different from the dimensions of the other matrices (' + str(acc['grid']) + ')')
+
+    count = acc['count'] + 1
+
+    seen = set()
+
+    for var, kind, data in recs:
+
+        if kind == 'tag':
+            acc['sigs'].setdefault(var, int(data[0]))
+            continue
+
+        values = data.astype(np.float64)
+
+        seen.add((kind, var))
+
+        rec = acc['records'].get((kind, var))
+
+        if rec is None:
+            if acc['count'] > 0:
+                raise ValueError('The record ' + str(var) + ' (' + str(kind) + ') of ' + str(file_name) +
+                                 ' is not in the other matrices')
+            acc['records'][(kind, var)] = {'mean': values, 'm2': np.zeros_like(values),
+                                           'min': values.copy(), 'max': values.copy()}
+            continue
+
+        delta = values - rec['mean']
+        rec['mean'] += delta / count
+        rec['m2'] += delta * (values - rec['mean'])
+
+        np.minimum(rec['min'], values, out=rec['min'])
+        np.maximum(rec['max'], values, out=rec['max'])
+
+    # All the matrices must have the same records (eg., a matrix without oz and cw can't be mixed with the others)
+    missing = set(acc['records']) - seen
+
+    if missing:
+        raise ValueError('The records ' + str(sorted(missing)) + ' of the other matrices are not in ' + str(file_name))
+
+    acc['count'] = count
+
+    return acc
+
+# This function merges two accumulators (parallel update of the mean and m2 by Chan et al.) and returns the merged
+# accumulator (the first one, updated in place)
+def merge_accumulators(acc, other):
+
+    if other['count'] == 0:
+        return acc
+
+    if acc['count'] == 0:
+        return other
+
+    if acc['grid'] != other['grid']:
+        raise ValueError('The dimensions of the matrices are different: ' + str(acc['grid']) + ' and ' + str(other['grid']))
+
+    if set(acc['records']) != set(other['records']):
+        raise ValueError('The records of the matrices are different: ' +
+                         str(sorted(set(acc['records']) ^ set(other['records']))))
+
+    na, nb = acc['count'], other['count']
+    count = na + nb
+
+    for key, rec in acc['records'].items():
+
+        orec = other['records'][key]
+
+        delta = orec['mean'] - rec['mean']
+        rec['mean'] += delta * (nb / count)
+        rec['m2'] += orec['m2'] + delta**2 * (na * nb / count)
+
+        np.minimum(rec['min'], orec['min'], out=rec['min'])
+        np.maximum(rec['max'], orec['max'], out=rec['max'])
+
+    acc['count'] = count
+
+    return acc
+
+# This function accumulates the statistics of a list of files (in a worker process of ensemble_stats)
+def accumulate_files(file_names):
+
+    acc = new_accumulator()
+
+    for file_name in file_names:
+        accumulate_file(acc, file_name)
+
+    return acc
+
+# This function returns the Berror objects (one for each statistic) of an accumulator
+def accumulator_berrors(acc, ddof=0):
+
+    from . import Berror
+
+    nlev, nlat, nlon = acc['grid']
+
+    values = {}
+
+    for key, rec in acc['records'].items():
+        var = rec['m2'] / max(acc['count'] - ddof, 1)
+        values[key] = {'mean': rec['mean'], 'std': np.sqrt(var), 'var': var, 'min': rec['min'], 'max': rec['max']}
+
+    bfiles = {}
+
+    for name in ensemble_stats_names:
+
+        bfile = Berror(name)
+
+        bfile._set_grid(nlev, nlat, nlon)
+
+        bfile.sigs = dict(acc['sigs'])
+        bfile.count = acc['count']
+
+        bfile.balprojs = {}
+        bfile.amplitudes = {}
+        bfile.hscales = {}
+        bfile.vscales = {}
+
+        for (kind, var), vals in values.items():
+            getattr(bfile, kind)[var] = bfile._record_dataarray(var, kind, vals[name].astype(np.float32))
+
+        bfile.amplitudes_names = {var: da.name for var, da in bfile.amplitudes.items()}
+        bfile.hscales_var_names = {var: da.name for var, da in bfile.hscales.items()}
+        bfile.vscales_var_names = {var: da.name for var, da in bfile.vscales.items()}
+
+        bfile.my_name(name)
+
+        bfiles[name] = bfile
+
+    return bfiles
+
+def ensemble_stats(file_names, workers=None, ddof=0):
+    """
+    ensemble_stats
+    --------------
+
+    This function computes the mean, standard deviation, variance, minimum and maximum of each value of each record of
+    a set of background error covariance matrices (eg., all the cycles of a month) in a single pass over the files.
+    The files are read one record at a time and the statistics are updated with the Welford's algorithm, so that the
+    memory used is about the size of a few matrices, regardless of the number of files. With more than one worker, the
+    files are split among a pool of processes and the partial statistics of the processes are merged at the end. All
+    the matrices must have the same dimensions and the same records (eg., matrices without oz and cw can't be mixed
+    with matrices with them); a ValueError is raised otherwise.
+
+    Input parameters
+    ----------------
+        file_names: list with the names of the files
+        workers   : number of processes (default: None, the files are read by the calling process)
+        ddof      : delta degrees of freedom of the variance and standard deviation (default: 0)
+
+    Result
+    ------
+        dictionary with a Berror object (with the records read) for each statistic ('mean', 'std', 'var', 'min' and
+        'max'); the number of files is given by the count attribute of the objects
+
+    Use
+    ---
+        import glob
+        import gsiberror as gb
+
+        st = gb.ensemble_stats(sorted(glob.glob('matrizes/*.gcv')), workers=4)
+
+        gb.plot_amplitudes([st['mean'], st['std']], 'sf')
+    """
+
+    file_names = [os.fspath(file_name) for file_name in file_names]
+
+    if not file_names:
+        raise ValueError('No files were given')
+
+    if workers is None or workers <= 1 or len(file_names) == 1:
+        acc = accumulate_files(file_names)
+    else:
+        nchunks = min(workers, len(file_names))
+        chunks = [file_names[i::nchunks] for i in range(nchunks)]
+
+        with ProcessPoolExecutor(max_workers=nchunks) as executor:
+            accs = list(executor.map(accumulate_files, chunks))
+
+        acc = accs[0]
+        for other in accs[1:]:
+            acc = merge_accumulators(acc, other)
+
+    return accumulator_berrors(acc, ddof=ddof)
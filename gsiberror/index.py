@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import numpy as np
+
+from .records import scan_records, record_name, record_shape, detect_layout, layout_dtypes
+
+# Version of the layout of the index files (changing it invalidates the existing index files)
+index_version = 2
+
+# This function returns the name of the index file (sidecar) of a .gcv file
+def index_path(file_name):
+
+    return str(file_name) + '.idx'
+
+# This function returns the size and the modification time of a file, which are used as the key of its index
+def file_key(file_name):
+
+    st = os.stat(file_name)
+
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+# This function walks the records of a .gcv file (skipping the data) and returns its index, a dictionary with the
+# dimensions of the matrix, the number of levels of each control variable (sigs) and a list with the variable, kind,
+# name, byte offset, shape and dtype of each record
+def build_index(file_name):
+
+    index = {'version': index_version}
+    index.update(file_key(file_name))
+
+    entries = []
+
+    with open(file_name, 'rb') as fobj:
+
+        layout = detect_layout(fobj)[0]
+
+        rdt = layout_dtypes(layout)[2]
+
+        for var, kind, offset, size, data in scan_records(fobj, read=False, layout=layout):
+            if kind == 'header':
+                nlev, nlat, nlon = (int(n) for n in data[:3])
+                index['grid'] = [nlev, nlat, nlon]
+                index['sigs'] = {}
+            elif kind == 'tag':
+                index['sigs'][var] = int(data[0])
+            else:
+                entries.append({'var': var,
+                                'kind': kind,
+                                'name': record_name(var, kind),
+                                'offset': offset,
+                                'shape': list(record_shape(var, nlat, nlon, nlev)),
+                                'dtype': rdt})
+
+    index['records'] = entries
+
+    return index
+
+# This function returns the index of a .gcv file; the index is read from the sidecar file when it exists and its key
+# (size and modification time) matches the file, otherwise it is rebuilt and, if cache is True, written to the sidecar
+# (files in read-only directories are just indexed again in the next call)
+def load_index(file_name, cache=True):
+
+    key = file_key(file_name)
+
+    try:
+        with open(index_path(file_name), 'r') as fidx:
+            index = json.load(fidx)
+        if index.get('version') == index_version and all(index.get(k) == key[k] for k in key):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    index = build_index(file_name)
+
+    if cache:
+        tmp_path = index_path(file_name) + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path, 'w') as fidx:
+                json.dump(index, fidx)
+            os.replace(tmp_path, index_path(file_name))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return index
+
+# This function returns the entry of the index for the record of a given kind of a variable
+def find_record(index, var, kind):
+
+    for entry in index['records']:
+        if entry['var'] == var and entry['kind'] == kind:
+            return entry
+
+    raise KeyError('No ' + str(kind) + ' record for ' + repr(var) + ' in the index')
+
+# This function reads the data of one record of the index (flat, in the Fortran order) from an opened file, seeking
+# straight to its offset; if a memory map of the file is given instead, a view into the map is returned
+def read_indexed_record(fobj, entry):
+
+    count = int(np.prod(entry['shape']))
+
+    if isinstance(fobj, np.ndarray):
+        return np.frombuffer(fobj, dtype=entry['dtype'], count=count, offset=entry['offset'])
+
+    fobj.seek(entry['offset'])
+
+    return np.fromfile(fobj, dtype=entry['dtype'], count=count)
@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+
+import os
+import xarray as xr
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# This function reads all the records of a .gcv file (in the native byte order) and returns them as a xarray dataset
+def read_dataset(file_name):
+
+    from . import Berror
+
+    bfile = Berror(file_name)
+
+    bfile.read_records(native=True)
+
+    return bfile.to_dataset()
+
+def open_many(file_names, workers=None, processes=False):
+    """
+    open_many
+    ---------
+
+    This function reads several background error covariance matrices at the same time, with a pool of threads (or
+    processes), and returns a single xarray dataset with the records of all the matrices stacked along a new 'matrix'
+    dimension. The matrices are aligned by their latitude, longitude and level coordinates (eg., a matrix with 64
+    levels and another one with 28 levels give 64 levels, with NaN for the levels 29 to 64 of the second one).
+
+    Input parameters
+    ----------------
+        file_names: list with the names of the files
+        workers   : number of threads (or processes) used to read the files (default: the number of CPUs)
+        processes : if True, a pool of processes is used instead of a pool of threads (default: False)
+
+    Result
+    ------
+        ds: xarray dataset with the records (named as in the file) and the 'matrix' coordinate with the names of the
+            files; the dimensions of each matrix are given by the 'nlat', 'nlon' and 'nlev' coordinates
+
+    Use
+    ---
+        import gsiberror as gb
+
+        ds = gb.open_many(['arquivo_matriz_B1.gcv', 'arquivo_matriz_B2.gcv'], workers=2)
+
+        ds['corzin_sf'].max(dim=['level', 'latitude'])
+    """
+
+    file_names = [os.fspath(file_name) for file_name in file_names]
+
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    with executor:
+        dss = list(executor.map(read_dataset, file_names))
+
+    dss = [ds.assign_coords(nlat=ds.attrs['nlat'], nlon=ds.attrs['nlon'], nlev=ds.attrs['nlev']) for ds in dss]
+
+    ds = xr.concat(dss, dim='matrix', join='outer', combine_attrs='drop_conflicts')
+
+    return ds.assign_coords(matrix=file_names)
@@ -1,11 +1,133 @@
 #! /usr/bin/env python3
 
 import os
+import functools
+import numpy as np
+import xarray as xr
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from mpl_toolkits import axes_grid1
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
+from cartopy.mpl.feature_artist import FeatureArtist
+
+from . import profiling
+
+# This function returns the map projection of the sst plots (created once and shared by all the panels)
+@functools.lru_cache(maxsize=None)
+def map_crs():
+
+    return ccrs.PlateCarree()
+
+# This function returns the land and coastline features of the sst plots; the geometries are read once and the same
+# features (and geometries) are shared by all the panels, so that the paths computed by cartopy for them are reused
+@functools.lru_cache(maxsize=None)
+def map_features(scale='110m'):
+
+    crs = map_crs()
+
+    land = cfeature.ShapelyFeature(tuple(cfeature.NaturalEarthFeature('physical', 'land', scale).geometries()), crs, 
+                                   edgecolor='face', facecolor='white', zorder=2)
+    coastline = cfeature.ShapelyFeature(tuple(cfeature.NaturalEarthFeature('physical', 'coastline', scale).geometries()), crs, 
+                                        edgecolor='black', facecolor='none', zorder=3)
+
+    return land, coastline
+
+# This function adds the land and coastline features to a map
+def decorate_map(ax):
+
+    with profiling.stage('cartopy'):
+        for feature in map_features():
+            ax.add_feature(feature)
+
+# This function creates the figure and the axes (one panel per matrix) used by the plotting functions; the axes can be
+# given to the plotting functions (axes=...) to reuse the same figure in repeated calls (eg., for several matrices)
+def prepare_axes(npanels, rec=None):
+
+    length_x_axis = 20
+    length_y_axis = 10
+    fig_height = 5.
+        
+    rows = 1
+    columns = npanels    
+    
+    height = length_y_axis * rows
+    width = length_x_axis * columns    
+    
+    plot_aspect_ratio= float(width) / float(height)           
+       
+    with profiling.stage('axes'):
+        
+        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))         
+            
+        spec = fig.add_gridspec(ncols=npanels, nrows=rows, wspace = .25, hspace = .25)              
+
+        axes = []
+
+        for i in range(rows*columns):
+            if rec == 'sst':
+                ax = fig.add_subplot(spec[i], projection=map_crs())
+                decorate_map(ax)
+            else:
+                ax = fig.add_subplot(spec[i])
+            axes.append(ax)
+
+    return fig, axes
+
+# This function removes the data plotted in the axes by a previous call to the plotting functions (including the
+# colorbars), keeping the map decoration
+def clear_axes(axes):
+
+    for ax in axes:
+
+        for artist in list(ax.collections) + list(ax.lines) + list(ax.images) + list(ax.patches):
+
+            if isinstance(artist, FeatureArtist):
+                continue
+
+            if getattr(artist, 'colorbar', None) is not None:
+                artist.colorbar.remove()
+
+            artist.remove()
+
+        ax.relim()
+        ax.autoscale_view()
+
+# This function reduces a 2-D field to about the resolution (in pixels) of the axes where it is plotted (level of
+# detail) before contouring, by averaging blocks of points (lod=True or lod='mean') or by keeping the most extreme
+# value of each block (lod='minmax'); with lod=False (full resolution, eg., for publication) the field is unchanged
+def lod_field(da, ax, lod):
+
+    if lod not in (False, True, 'mean', 'minmax'):
+        raise ValueError('Unknown level of detail: ' + repr(lod))
+
+    if not lod or da.ndim != 2:
+        return da
+
+    if lod is True:
+        lod = 'mean'
+
+    # The first dimension is plotted along the y axis and the second one along the x axis
+    bbox = ax.get_window_extent()
+    npix = {da.dims[0]: bbox.height, da.dims[1]: bbox.width}
+
+    factors = {dim: int(np.ceil(da.sizes[dim] / max(npix[dim], 1.))) for dim in da.dims}
+    factors = {dim: factor for dim, factor in factors.items() if factor > 1}
+
+    if not factors:
+        return da
+
+    with profiling.stage('prep'):
+
+        blocks = da.coarsen(factors, boundary='pad', coord_func='mean')
+
+        if lod == 'mean':
+            return blocks.mean()
+        elif lod == 'minmax':
+            bmean = blocks.mean()
+            bmin = blocks.min()
+            bmax = blocks.max()
+            return xr.where(bmax - bmean >= bmean - bmin, bmax, bmin).rename(da.name)
 
 # This function defines the names of the variables and mnemonics
 def var_name(var):    
@@ -40,33 +162,25 @@ def var_name(var):
     
     return vname, vsimb
 
-# This function defines global values of min and max given two xarrays
+# This function defines global values of min and max given two xarrays (the statistics of the records are
+# computed once by each matrix, see the record_stats method of the Berror class)
 def global_minmax(l_matrix, t_array, m_rec):
 
     lmin = []
     lmax = []
     
-    for mtx in l_matrix:
+    with profiling.stage('prep'):
+        for mtx in l_matrix:
           
-        if t_array == 'balprojs':
-            vmin = mtx.balprojs[str(m_rec)].min()
-            vmax = mtx.balprojs[str(m_rec)].max()
-        elif t_array == 'amplitudes':
-            vmin = mtx.amplitudes[str(m_rec)].min()
-            vmax = mtx.amplitudes[str(m_rec)].max()            
-        elif t_array == 'hscales':
-            vmin = mtx.hscales[str(m_rec)].min()
-            vmax = mtx.hscales[str(m_rec)].max()            
-        elif t_array == 'vscales':
-            vmin = mtx.vscales[str(m_rec)].min()
-            vmax = mtx.vscales[str(m_rec)].max()
+            rstats = mtx.record_stats(t_array, str(m_rec))
             
-        lmin.append(vmin)
-        lmax.append(vmax)
+            lmin.append(rstats['min'])
+            lmax.append(rstats['max'])
 
     return min(lmin), max(lmax)
 
 # This function plots the regression coefficients
+@profiling.profiled('plot_reg_coeffs')
 def plot_reg_coeffs(lmatrix, rec, lev, **kwargs):
           
     if 'eqrange' in kwargs:
@@ -83,52 +197,58 @@ def plot_reg_coeffs(lmatrix, rec, lev, **kwargs):
         savefig = kwargs['savefig']
     else:
         savefig = False         
+
+    if 'figname' in kwargs:
+        figname = kwargs['figname']
+    else:
+        figname = 'reg_coeffs_' + str(rec) + '.png'
+
+    if 'axes' in kwargs:
+        axes = kwargs['axes']
+    else:
+        axes = None
+
+    if 'lod' in kwargs:
+        lod = kwargs['lod']
+    else:
+        lod = False
         
     len_lmatrix = len(lmatrix)
                
     if eqrange:           
         minval, maxval = global_minmax(lmatrix, 'balprojs', str(rec))    
     
-    length_x_axis = 20
-    length_y_axis = 10
-    fig_height = 5.
-        
-    rows = 1
-    columns = len_lmatrix    
-    
-    height = length_y_axis * rows
-    width = length_x_axis * columns    
-    
-    plot_aspect_ratio= float(width) / float(height)    
- 
-    fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))     
-    
-    spec = fig.add_gridspec(ncols=len_lmatrix, nrows=rows, wspace = .25, hspace = .25)
+    # Figure and axes (one panel per matrix); axes given by the user (see prepare_axes) are cleared and reused
+    if axes is None:
+        fig, axes = prepare_axes(len_lmatrix, rec)
+    else:
+        fig = axes[0].figure
+        clear_axes(axes)
         
     cbar_kwargs = {'spacing': 'proportional', 'pad': 0.08, 'shrink': 1, 'aspect': 15, 'extend':'neither'}          
         
-    for i in range(rows*columns):
+    for i in range(len_lmatrix):
         
-        ax = fig.add_subplot(spec[i])
+        ax = axes[i]
         
         if rec == 'agvin':
             nrec = 'Virtual Temperature'
             if eqrange:
-                im = lmatrix[i].balprojs[str(rec)].isel(level_2=lev).plot.contourf(vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
+                im = lod_field(lmatrix[i].balprojs[str(rec)].isel(level_2=lev), ax, lod).plot.contourf(vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
             else:
-                im = lmatrix[i].balprojs[str(rec)].isel(level_2=lev).plot.contourf(add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
+                im = lod_field(lmatrix[i].balprojs[str(rec)].isel(level_2=lev), ax, lod).plot.contourf(add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
         elif rec == 'bgvin':
             nrec = 'Velocity Potencial'
             if eqrange:
-                im = lmatrix[i].balprojs[str(rec)].plot.contourf(vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
+                im = lod_field(lmatrix[i].balprojs[str(rec)], ax, lod).plot.contourf(vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
             else:
-                im = lmatrix[i].balprojs[str(rec)].plot.contourf(add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
+                im = lod_field(lmatrix[i].balprojs[str(rec)], ax, lod).plot.contourf(add_colorbar=True, cbar_kwargs=cbar_kwargs, ax=ax)
         elif rec == 'wgvin':
             nrec = 'Surface Pressure'  
             # Note: multiplying by 1e2 (100) to make it comparable to https://dtcenter.ucar.edu/com-GSI/users/docs/presentations/2011_tutorial/L8_06302011-BkgObsErrs-DarylKleist.pdf
             wgproj = lmatrix[i].balprojs[str(rec)]*1e2
             if eqrange:
-                im = wgproj.isel(level=0,latitude=slice(0,-2)).plot.line(ylim=[minval.data, maxval.data], ax=ax)
+                im = wgproj.isel(level=0,latitude=slice(0,-2)).plot.line(ylim=[minval, maxval], ax=ax)
             else:
                 im = wgproj.isel(level=0,latitude=slice(0,-2)).plot.line(ax=ax)     
          
@@ -136,19 +256,21 @@ def plot_reg_coeffs(lmatrix, rec, lev, **kwargs):
         
         if suptitle:
             if rec == 'agvin':
-                sptitle = plt.suptitle('Projection of the Stream Function ($\psi$) at the level ' + str(lev) + ' over the vertical profile of the balanced part of ' + str(nrec) + ' ($\mathbf{G}_{'+str(lev)+'}$): $T_{b}=\mathbf{G}\psi$', y=1.05, fontsize=16)
+                sptitle = fig.suptitle('Projection of the Stream Function ($\psi$) at the level ' + str(lev) + ' over the vertical profile of the balanced part of ' + str(nrec) + ' ($\mathbf{G}_{'+str(lev)+'}$): $T_{b}=\mathbf{G}\psi$', y=1.05, fontsize=16)
             elif rec == 'bgvin':
-                sptitle = plt.suptitle('Projection of the Stream Function ($\psi$) over the balanced part of ' + str(nrec) + ' ($\mathbf{c}$): $\chi_{b}=\mathbf{c}\psi$', y=1.05, fontsize=16)
+                sptitle = fig.suptitle('Projection of the Stream Function ($\psi$) over the balanced part of ' + str(nrec) + ' ($\mathbf{c}$): $\chi_{b}=\mathbf{c}\psi$', y=1.05, fontsize=16)
             elif rec == 'wgvin':    
-                sptitle = plt.suptitle('Projection of the Stream Function of the Stream Function ($\psi$) over the balanced part of ' + str(nrec) + ' ($\mathbf{w}$): $ps_{b}=\mathbf{w}\psi$', y=1.05, fontsize=16)
+                sptitle = fig.suptitle('Projection of the Stream Function of the Stream Function ($\psi$) over the balanced part of ' + str(nrec) + ' ($\mathbf{w}$): $ps_{b}=\mathbf{w}\psi$', y=1.05, fontsize=16)
                         
     if savefig:
-        if suptitle:
-            fig.savefig('reg_coeffs_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
-        else:
-            fig.savefig('reg_coeffs_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight') 
+        with profiling.stage('savefig'):
+            if suptitle:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
+            else:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight') 
 
 # This function plots the amplitudes
+@profiling.profiled('plot_amplitudes')
 def plot_amplitudes(lmatrix, rec, **kwargs): 
     
     if 'eqrange' in kwargs:
@@ -170,6 +292,21 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
         savefig = kwargs['savefig']
     else:
         savefig = False             
+
+    if 'figname' in kwargs:
+        figname = kwargs['figname']
+    else:
+        figname = 'amplitudes_' + str(rec) + '.png'
+
+    if 'axes' in kwargs:
+        axes = kwargs['axes']
+    else:
+        axes = None
+
+    if 'lod' in kwargs:
+        lod = kwargs['lod']
+    else:
+        lod = False
         
     if rec == 'ps' or rec == 'sst':
         profile = False
@@ -179,43 +316,21 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
     if eqrange:           
         minval, maxval = global_minmax(lmatrix, 'amplitudes', str(rec))
 
-    length_x_axis = 20
-    length_y_axis = 10
-    fig_height = 5.
-        
-    rows = 1
-    columns = len_lmatrix    
-    
-    height = length_y_axis * rows
-    width = length_x_axis * columns    
-    
-    plot_aspect_ratio= float(width) / float(height)           
-       
-    fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))         
-        
-#    if profile:
-#        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height)) 
-#    else:
-#        if rec == 'sst':
-#            fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-#        else:
-#            fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-            
-    spec = fig.add_gridspec(ncols=len_lmatrix, nrows=rows, wspace = .25, hspace = .25)              
+    # Figure and axes (one panel per matrix); axes given by the user (see prepare_axes) are cleared and reused
+    if axes is None:
+        fig, axes = prepare_axes(len_lmatrix, rec)
+    else:
+        fig = axes[0].figure
+        clear_axes(axes)
             
     cbar_kwargs = {'spacing': 'proportional', 'pad': 0.08, 'shrink': 1, 'aspect': 15, 'extend':'neither'}            
         
-    crs = ccrs.PlateCarree()
-        
     nrec = var_name(rec)[0]
     srec = var_name(rec)[1]
      
-    for i in range(rows*columns):     
+    for i in range(len_lmatrix):     
         
-        if rec == 'sst':
-            ax = plt.subplot(spec[i], projection=crs)
-        else:
-            ax = plt.subplot(spec[i])
+        ax = axes[i]
         
         if profile:
             if eqrange:
@@ -224,9 +339,7 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
                 im = lmatrix[i].amplitudes[str(rec)].mean(dim='latitude').plot(ax=ax, y='level')
         else:
             if rec == 'sst':        
-                lmatrix[i].amplitudes[str(rec)].plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
-                ax.add_feature(cfeature.NaturalEarthFeature('physical', 'land', '110m', edgecolor='face', facecolor='white'))
-                ax.coastlines() 
+                lod_field(lmatrix[i].amplitudes[str(rec)], ax, lod).plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
             elif rec == 'qin':
                 # Note 1: slice(0,25) is applied to plot just the first quarter of the field
                 #         in an attempt to retrieve something comparable to https://dtcenter.ucar.edu/com-GSI/users/docs/presentations/2011_tutorial/L8_06302011-BkgObsErrs-DarylKleist.pdf
@@ -238,7 +351,7 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
                     im = ampqin.isel(latitude=slice(0,25)).drop('latitude').plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs, add_labels=False)
             elif rec == 'q':
                 # Note: multiplying by 1e2 (100) to make it comparable to the above document
-                ampq = lmatrix[i].amplitudes[str(rec)]*1e2
+                ampq = lod_field(lmatrix[i].amplitudes[str(rec)], ax, lod)*1e2
                 if eqrange:
                     im = ampq.plot.contourf(ax=ax, vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs)
                 else:
@@ -251,9 +364,9 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
                     im = lmatrix[i].amplitudes[str(rec)].plot(ax=ax)
             else:
                 if eqrange:
-                    im = lmatrix[i].amplitudes[str(rec)].plot.contourf(ax=ax, vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs)
+                    im = lod_field(lmatrix[i].amplitudes[str(rec)], ax, lod).plot.contourf(ax=ax, vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs)
                 else:
-                    im = lmatrix[i].amplitudes[str(rec)].plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
+                    im = lod_field(lmatrix[i].amplitudes[str(rec)], ax, lod).plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
 
         if rec == 'sst':
             ax.set_title(str(lmatrix[i].get_name()))
@@ -262,20 +375,22 @@ def plot_amplitudes(lmatrix, rec, **kwargs):
         
         if suptitle:
             if rec == 'sf':
-                sptitle = plt.suptitle('Standard Deviation of ' + str(nrec) + ' (' + str(srec) + ')', y=1.05, fontsize=16)      
+                sptitle = fig.suptitle('Standard Deviation of ' + str(nrec) + ' (' + str(srec) + ')', y=1.05, fontsize=16)      
             elif rec == 'q' or rec == 'qin':    
-                sptitle = plt.suptitle('Standard Deviation of the unbalanced part of ' + str(nrec) + ' (' + str(srec) + ', %)', y=1.05) 
+                sptitle = fig.suptitle('Standard Deviation of the unbalanced part of ' + str(nrec) + ' (' + str(srec) + ', %)', y=1.05) 
             else:
-                #sptitle = plt.suptitle('Desvio Padrão da Parte não balanceada da ' + str(nrec) + ' (' + str(srec) + ')', y=1.05) 
-                sptitle = plt.suptitle('Standard Deviation of the unbalanced part of ' + str(nrec) + ' (' + str(srec) + ')', y=1.05) 
+                #sptitle = fig.suptitle('Desvio Padrão da Parte não balanceada da ' + str(nrec) + ' (' + str(srec) + ')', y=1.05) 
+                sptitle = fig.suptitle('Standard Deviation of the unbalanced part of ' + str(nrec) + ' (' + str(srec) + ')', y=1.05) 
                 
     if savefig:
-        if suptitle:
-            fig.savefig('amplitudes_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
-        else:
-            fig.savefig('amplitudes_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight') 
+        with profiling.stage('savefig'):
+            if suptitle:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
+            else:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight') 
 
 # This function plots the horizontal length scales                
+@profiling.profiled('plot_hscales')
 def plot_hscales(lmatrix, rec, **kwargs): 
           
     if 'eqrange' in kwargs:
@@ -293,58 +408,47 @@ def plot_hscales(lmatrix, rec, **kwargs):
     else:
         savefig = False     
 
+    if 'figname' in kwargs:
+        figname = kwargs['figname']
+    else:
+        figname = 'hscales_' + str(rec) + '.png'
+
+    if 'axes' in kwargs:
+        axes = kwargs['axes']
+    else:
+        axes = None
+
+    if 'lod' in kwargs:
+        lod = kwargs['lod']
+    else:
+        lod = False
+
     len_lmatrix = len(lmatrix)
                
     if eqrange:           
         minval, maxval = global_minmax(lmatrix, 'hscales', str(rec))        
 
-#    if rec == 'sst':
-#        fig, axs = plt.subplots(1, len_lmatrix, constrained_layout=False, figsize=(20,4), subplot_kw={'projection': ccrs.PlateCarree()})
-#    else:
-#        fig, axs = plt.subplots(1, len_lmatrix, constrained_layout=False, figsize=(10,4))
-
-    length_x_axis = 20
-    length_y_axis = 10
-    fig_height = 5.
-        
-    rows = 1
-    columns = len_lmatrix    
-    
-    height = length_y_axis * rows
-    width = length_x_axis * columns    
-    
-    plot_aspect_ratio= float(width) / float(height)           
-
-    fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))    
-    
-#    if rec == 'sst':
-#        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-#    else:
-#        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-            
-    spec = fig.add_gridspec(ncols=len_lmatrix, nrows=rows, wspace = .25, hspace = .25) 
+    # Figure and axes (one panel per matrix); axes given by the user (see prepare_axes) are cleared and reused
+    if axes is None:
+        fig, axes = prepare_axes(len_lmatrix, rec)
+    else:
+        fig = axes[0].figure
+        clear_axes(axes)
 
     cbar_kwargs = {'spacing': 'proportional', 'pad': 0.08, 'shrink': 1, 'aspect': 15, 'extend':'neither'}         
-     
-    crs = ccrs.PlateCarree()
         
     nrec = var_name(rec)[0]   
     srec = var_name(rec)[1]   
      
-    for i in range(rows*columns):       
+    for i in range(len_lmatrix):       
         
-        if rec == 'sst':
-            ax = plt.subplot(spec[i], projection=crs)
-        else:
-            ax = plt.subplot(spec[i])
+        ax = axes[i]
        
         # m -> km to make it consistent with https://dtcenter.ucar.edu/com-GSI/users/docs/presentations/2011_tutorial/L8_06302011-BkgObsErrs-DarylKleist.pdf
-        hscl = lmatrix[i].hscales[str(rec)]*1e-3
+        hscl = lod_field(lmatrix[i].hscales[str(rec)], ax, lod)*1e-3
     
         if rec == 'sst':  
             hscl.plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
-            ax.add_feature(cfeature.NaturalEarthFeature('physical', 'land', '110m', edgecolor='face', facecolor='white'))
-            ax.coastlines()
         
         elif rec == 'ps':
             if eqrange:
@@ -363,15 +467,17 @@ def plot_hscales(lmatrix, rec, **kwargs):
             ax.set_title(str(lmatrix[i].get_name()) + ' (' + str(lmatrix[i].nlev) + ' levels)')
         
         if suptitle:
-            sptitle = plt.suptitle('Horizontal Length Scale of ' + str(nrec) + ' (' + str(srec) + ', km)', y=1.05, fontsize=16)
+            sptitle = fig.suptitle('Horizontal Length Scale of ' + str(nrec) + ' (' + str(srec) + ', km)', y=1.05, fontsize=16)
             
     if savefig:
-        if suptitle:
-            fig.savefig('hscales_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
-        else:
-            fig.savefig('hscales_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight')             
+        with profiling.stage('savefig'):
+            if suptitle:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
+            else:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight')             
 
 # This function plots vertical length scales            
+@profiling.profiled('plot_vscales')
 def plot_vscales(lmatrix, rec, **kwargs):   
 
     if 'eqrange' in kwargs:
@@ -388,61 +494,56 @@ def plot_vscales(lmatrix, rec, **kwargs):
         savefig = kwargs['savefig']
     else:
         savefig = False            
+
+    if 'figname' in kwargs:
+        figname = kwargs['figname']
+    else:
+        figname = 'vscales_' + str(rec) + '.png'
+
+    if 'axes' in kwargs:
+        axes = kwargs['axes']
+    else:
+        axes = None
+
+    if 'lod' in kwargs:
+        lod = kwargs['lod']
+    else:
+        lod = False
         
     len_lmatrix = len(lmatrix)
                
     if eqrange:           
         minval, maxval = global_minmax(lmatrix, 'vscales', str(rec))    
 
-#    if rec == 'sst':
-#        fig, axs = plt.subplots(1, len_lmatrix, constrained_layout=False, figsize=(20,4), subplot_kw={'projection': ccrs.PlateCarree()})
-#    else:
-#        fig, axs = plt.subplots(1, len_lmatrix, constrained_layout=False, figsize=(10,4))
-
-    length_x_axis = 20
-    length_y_axis = 10
-    fig_height = 5.
-        
-    rows = 1
-    columns = len_lmatrix    
-    
-    height = length_y_axis * rows
-    width = length_x_axis * columns    
-    
-    plot_aspect_ratio= float(width) / float(height)           
-        
-#    if rec == 'sst':
-#        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-#    else:
-#        fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))
-            
-    fig = plt.figure(figsize=(fig_height * plot_aspect_ratio, fig_height))            
-            
-    spec = fig.add_gridspec(ncols=len_lmatrix, nrows=rows, wspace = .25, hspace = .25) 
+    # Figure and axes (one panel per matrix); axes given by the user (see prepare_axes) are cleared and reused
+    if axes is None:
+        fig, axes = prepare_axes(len_lmatrix, rec)
+    else:
+        fig = axes[0].figure
+        clear_axes(axes)
 
     cbar_kwargs = {'spacing': 'proportional', 'pad': 0.08, 'shrink': 1, 'aspect': 15, 'extend':'neither'}         
-     
-    crs = ccrs.PlateCarree()        
         
     nrec = var_name(rec)[0]   
     srec = var_name(rec)[1]   
      
-    for i in range(rows*columns):          
+    for i in range(len_lmatrix):          
         
-        ax = plt.subplot(spec[i])        
+        ax = axes[i]
         
         if eqrange:
-            lmatrix[i].vscales[str(rec)].plot.contourf(ax=ax, vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs)
+            lod_field(lmatrix[i].vscales[str(rec)], ax, lod).plot.contourf(ax=ax, vmin=minval, vmax=maxval, add_colorbar=True, cbar_kwargs=cbar_kwargs)
         else:         
-            lmatrix[i].vscales[str(rec)].plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
+            lod_field(lmatrix[i].vscales[str(rec)], ax, lod).plot.contourf(ax=ax, add_colorbar=True, cbar_kwargs=cbar_kwargs)
 
         ax.set_title(str(lmatrix[i].get_name()) + ' (' + str(lmatrix[i].nlev) + ' levels)')
     
         if suptitle:
-            sptitle = plt.suptitle('Vertical Length Scale of ' + str(nrec) + ' (' + str(srec) + ', grid units)', y=1.05, fontsize=16)
+            sptitle = fig.suptitle('Vertical Length Scale of ' + str(nrec) + ' (' + str(srec) + ', grid units)', y=1.05, fontsize=16)
             
     if savefig:
-        if suptitle:
-            fig.savefig('vscales_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
-        else:
-            fig.savefig('vscales_' + str(rec) + '.png', dpi=fig.dpi, bbox_inches='tight')            
+        with profiling.stage('savefig'):
+            if suptitle:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight', bbox_extra_artists=[sptitle])         
+            else:
+                fig.savefig(figname, dpi=fig.dpi, bbox_inches='tight')            
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3
+
+import time
+import functools
+import logging
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Profiles active in each thread (the last one receives the stages)
+_local = threading.local()
+
+class Profile(object):
+    """
+    Profile
+    =======
+
+    Class with the wall time, the number of bytes read and the peak of memory allocated (with tracemalloc) of each
+    stage of reading and plotting the matrices (see the profile function). The stages with the same name are summed
+    (eg., the reshapes of all the records) and the stages may be nested: 'time' is the total time of a stage and
+    'self' is the time of the stage without the time of the stages inside it.
+
+    """
+
+    def __init__(self, name='', memory=True):
+        self.name = name
+        self.memory = memory
+        self.stages = {}
+        self.time = 0.
+        self._frames = []
+
+    def as_dict(self):
+        """
+        as_dict
+        -------
+
+        This method returns the stages of the profile as a dictionary, with the name of each stage (in the order they
+        were first entered) and a dictionary with the number of calls ('calls'), the total and self wall times in
+        seconds ('time' and 'self'), the number of bytes read ('bytes') and the peak of memory allocated in bytes
+        ('peak', None if the memory is not traced).
+        """
+
+        return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def report(self):
+        """
+        report
+        ------
+
+        This method returns a table (string) with the stages of the profile.
+        """
+
+        lines = ['{:<16s} {:>6s} {:>10s} {:>10s} {:>12s} {:>12s}'.format('stage', 'calls', 'time (s)', 'self (s)',
+                                                                         'read (MiB)', 'peak (MiB)')]
+
+        for name, stage in self.stages.items():
+            peak = stage['peak'] / 2**20 if stage['peak'] is not None else float('nan')
+            lines.append('{:<16s} {:>6d} {:>10.4f} {:>10.4f} {:>12.2f} {:>12.2f}'.format(name, stage['calls'],
+                         stage['time'], stage['self'], stage['bytes'] / 2**20, peak))
+
+        lines.append('{:<16s} {:>6s} {:>10.4f}'.format('total', '', self.time))
+
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'Profile(' + repr(self.name) + ')\n' + self.report()
+
+    # This method starts a stage (the peak of memory is reset, keeping the peak of the enclosing stage)
+    def _enter(self, name, nbytes):
+
+        frame = {'name': name, 'bytes': nbytes, 'child_time': 0., 'child_peak': 0, 'current': 0}
+
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._frames:
+                self._frames[-1]['child_peak'] = max(self._frames[-1]['child_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['current'] = current
+
+        self._frames.append(frame)
+
+        frame['start'] = time.perf_counter()
+
+    # This method ends the current stage and adds it to the stages of the profile
+    def _exit(self):
+
+        elapsed = time.perf_counter()
+
+        frame = self._frames.pop()
+
+        elapsed -= frame['start']
+
+        stage = self.stages.setdefault(frame['name'], {'calls': 0, 'time': 0., 'self': 0., 'bytes': 0,
+                                                       'peak': 0 if self.memory else None})
+
+        stage['calls'] += 1
+        stage['time'] += elapsed
+        stage['self'] += elapsed - frame['child_time']
+        stage['bytes'] += frame['bytes']
+
+        if self._frames:
+            self._frames[-1]['child_time'] += elapsed
+
+        if self.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            stage['peak'] = max(stage['peak'], peak - frame['current'])
+            if self._frames:
+                self._frames[-1]['child_peak'] = max(self._frames[-1]['child_peak'], peak)
+
+# This class is the context manager of a stage (see the stage function)
+class _Stage(object):
+
+    def __init__(self, prof, name, nbytes):
+        self.prof = prof
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.prof._enter(self.name, self.nbytes)
+        return self
+
+    def __exit__(self, *args):
+        self.prof._exit()
+        return False
+
+# This class is the context manager used when no profile is active (it does nothing)
+class _NoStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_no_stage = _NoStage()
+
+# This function returns the profile active in the current thread (None if there is no active profile)
+def active_profile():
+
+    profiles = getattr(_local, 'profiles', None)
+
+    return profiles[-1] if profiles else None
+
+# This function returns a context manager that measures a stage of the active profile (it does nothing if there is no
+# active profile); nbytes is the number of bytes read by the stage
+def stage(name, nbytes=0):
+
+    prof = active_profile()
+
+    if prof is None:
+        return _no_stage
+
+    return _Stage(prof, name, nbytes)
+
+# This function returns a decorator that measures each call of a function as a stage of the active profile
+def profiled(name):
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+# This class is the context manager returned by the profile function
+class _Profiling(object):
+
+    def __init__(self, prof):
+        self.prof = prof
+        self.tracing = False
+
+    def __enter__(self):
+
+        if self.prof.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+        if getattr(_local, 'profiles', None) is None:
+            _local.profiles = []
+
+        _local.profiles.append(self.prof)
+
+        self.start = time.perf_counter()
+
+        return self.prof
+
+    def __exit__(self, *args):
+
+        self.prof.time += time.perf_counter() - self.start
+
+        _local.profiles.remove(self.prof)
+
+        if self.tracing:
+            tracemalloc.stop()
+
+        for name, stage in self.prof.stages.items():
+            logger.info('%s %s: calls=%d time=%.4fs self=%.4fs read=%dB peak=%sB', self.prof.name, name,
+                        stage['calls'], stage['time'], stage['self'], stage['bytes'], stage['peak'])
+
+        logger.info('%s total: time=%.4fs', self.prof.name, self.prof.time)
+
+        return False
+
+def profile(name='', memory=True):
+    """
+    profile
+    -------
+
+    This function returns a context manager that measures the stages of reading and plotting the matrices done inside
+    it (in the same thread): reading of the header, structured read of the file (np.fromfile), byte swapping, reshapes
+    (Fortran order), construction of the dataset with all the records ('dataset') and of the DataArrays of each
+    dictionary ('balprojs', 'amplitudes', 'hscales' and 'vscales', views into the dataset) and, in the plot functions,
+    preparation of the data ('prep': statistics and level of detail), creation of the figure ('axes'), map decoration
+    ('cartopy') and saving of the figure ('savefig'); the drawing of the panels (contourf) is the self time of the 
+    stage of each plot function (eg., 'plot_amplitudes'). At the end, the stages are also written to the log (logger
+    'gsiberror.profiling', level INFO).
+
+    Input parameters
+    ----------------
+        name  : name of the profile (used in the log)
+        memory: if True, the peak of memory allocated by each stage is traced with tracemalloc (slower)
+                (default: True)
+
+    Result
+    ------
+        context manager, which gives a Profile object (see the as_dict and report methods)
+
+    Use
+    ---
+        import gsiberror as gb
+
+        bfile = gb.Berror('arquivo_matriz_B.gcv')
+
+        with gb.profile('sf') as prof:
+            bfile.read_records()
+            gb.plot_amplitudes([bfile], 'sf', savefig=True)
+
+        print(prof.report())
+    """
+
+    return _Profiling(Profile(name, memory=memory))
@@ -0,0 +1,498 @@
+#! /usr/bin/env python3
+
+import functools
+import collections
+import numpy as np
+
+# Names of the records with the amplitudes (standard deviations) for each control variable
+amplitudes_names = {
+    'sf':  'corzin_sf',
+    'vp':  'corzin_vp',
+    't':   'corzin_t',
+    'q':   'corzin_q',
+    'qin': 'corqin_q',
+    'oz':  'corzin_oz',
+    'ps':  'corpin_ps',
+    'cw':  'corzin_cw',
+    'sst': 'corsstin_sst',
+}
+
+# Names of the records with the horizontal length scales for each control variable
+hscales_var_names = {
+    'sf':  'hscalesin_sf',
+    'vp':  'hscalesin_vp',
+    't':   'hscalesin_t',
+    'q':   'hscalesin_q',
+    'oz':  'hscalesin_oz',
+    'ps':  'hscalespin_ps',
+    'cw':  'hscalesin_cw',
+    'sst': 'hsstin_ps',
+}
+
+# Names of the records with the vertical length scales for each control variable
+vscales_var_names = {
+    'sf':  'vscalesin_sf',
+    'vp':  'vscalesin_vp',
+    't':   'vscalesin_t',
+    'q':   'vscalesin_q',
+    'oz':  'vscalesin_oz',
+    'cw':  'vscalesin_cw',
+}
+
+# Names of the regression coefficients (balance projection matrices), in the order they are written
+balprojs_names = ['agvin', 'bgvin', 'wgvin']
+
+# Control variables, in the order they are written after the regression coefficients
+control_vars = ['sf', 'vp', 't', 'q', 'oz', 'cw', 'ps', 'sst']
+
+# Layout of a .gcv file: byte order ('>' big endian or '<' little endian), sizes (in bytes) of the record markers, of
+# the integers and of the reals, control variables (in the order they are written) and qin (True if the amplitudes
+# record of q also has the normalized relative humidity amplitudes)
+Layout = collections.namedtuple('Layout', ['byteorder', 'marker', 'integer', 'real', 'vars', 'qin'])
+
+# Layout written by the GSI (big endian, 4 bytes markers, integers and reals, all the control variables)
+default_layout = Layout('>', 4, 4, 4, tuple(control_vars), True)
+
+# This function returns the name of the record of a given kind for a control variable
+def record_name(var, kind):
+
+    if kind == 'balprojs':
+        return var
+    elif kind == 'amplitudes':
+        return amplitudes_names[var]
+    elif kind == 'hscales':
+        return hscales_var_names[var]
+    elif kind == 'vscales':
+        return vscales_var_names[var]
+
+    raise ValueError('Unknown record kind: ' + str(kind))
+
+# This function returns the shape (in the Fortran order) of the record of a control variable
+def record_shape(var, nlat, nlon, nlev):
+
+    if var == 'agvin':
+        return (nlat, nlev, nlev)
+    elif var == 'ps':
+        return (nlat,)
+    elif var == 'sst':
+        return (nlat, nlon)
+
+    return (nlat, nlev)
+
+# This function returns the dimensions of a record (as provided by the read_records method) and the order of the axes
+# of the record in the file (Fortran order) to get them
+def record_dims(var):
+
+    if var == 'agvin':
+        return ('level', 'latitude', 'level_2'), (1, 0, 2)
+    elif var == 'ps':
+        return ('latitude',), (0,)
+    elif var == 'sst':
+        return ('latitude', 'longitude'), (0, 1)
+
+    return ('level', 'latitude'), (1, 0)
+
+# This function returns the number of values in the record of a control variable
+def record_size(var, nlat, nlon, nlev):
+
+    return int(np.prod(record_shape(var, nlat, nlon, nlev)))
+
+# This function returns the structure of the whole file (after the first record marker) as a numpy dtype;
+# the dtype only depends on the dimensions of the matrix and is cached
+@functools.lru_cache(maxsize=32)
+def records_dtype(nlat, nlon, nlev):
+
+    # Define the records sizes from within the file ('>f4' indicates 32 bits floats, big endian)
+    tnlat = str(nlat) + '>f4'
+    s2d = str(nlat*nlev) + '>f4'
+    sst2d = str(nlat*nlon) + '>f4'
+    s3d = str(nlat*nlev*nlev) + '>f4'
+
+    # Define a structure for the records within the file ('padX' = 4 bytes; '>i4' indicates 32 bits integers, big endian)
+    # Maybe this isn't the best way to read the records but it is explicity, at least
+    dt =          [ ('grid', '3>i4'), 
+               
+                    ('pad1', '>i4'), 
+                    ('pad2', '>i4'), ('agvin',s3d), ('bgvin', s2d), ('wgvin', s2d), ('pad3', '>i4'), 
+                   
+                    ('pad4', '>i4'), ('sf', 'S5'), ('sig_sf', '>i4'), ('pad5', '>i4'), 
+                    ('pad6', '>i4'), ('corzin_sf', s2d), ('pad7', '>i4'), 
+                    ('pad8', '>i4'), ('hscalesin_sf', s2d), ('pad9', '>i4'), 
+                    ('pad10', '>i4'), ('vscalesin_sf', s2d), ('pad11', '>i4'), 
+               
+                    ('pad12', '>i4'), ('vp', 'S5'), ('sig_vp', '>i4'), ('pad13', '>i4'),
+                    ('pad14', '>i4'), ('corzin_vp', s2d), ('pad15', '>i4'), 
+                    ('pad16', '>i4'), ('hscalesin_vp', s2d), ('pad17', '>i4'), 
+                    ('pad18', '>i4'), ('vscalesin_vp', s2d), ('pad19', '>i4'), 
+               
+                    ('pad20', '>i4'), ('t', 'S5'), ('sig_t', '>i4'), ('pad21', '>i4'),
+                    ('pad22', '>i4'), ('corzin_t', s2d), ('pad23', '>i4'), 
+                    ('pad24', '>i4'), ('hscalesin_t', s2d), ('pad25', '>i4'), 
+                    ('pad26', '>i4'), ('vscalesin_t', s2d), ('pad27', '>i4'), 
+               
+                    ('pad28', '>i4'), ('q', 'S5'), ('sig_q', '>i4'), ('pad29', '>i4'),
+                    ('pad30', '>i4'), ('corzin_q', s2d), ('corqin_q', s2d), ('pad31', '>i4'), 
+                    ('pad32', '>i4'), ('hscalesin_q', s2d), ('pad33', '>i4'), 
+                    ('pad34', '>i4'), ('vscalesin_q', s2d), ('pad35', '>i4'), 
+               
+                    ('pad36', '>i4'), ('oz', 'S5'), ('sig_oz', '>i4'), ('pad37', '>i4'),
+                    ('pad38', '>i4'), ('corzin_oz', s2d), ('pad39', '>i4'), 
+                    ('pad40', '>i4'), ('hscalesin_oz', s2d), ('pad41', '>i4'), 
+                    ('pad42', '>i4'), ('vscalesin_oz', s2d), ('pad43', '>i4'), 
+                                  
+                    ('pad44', '>i4'), ('cw', 'S5'), ('sig_cw', '>i4'), ('pad45', '>i4'),
+                    ('pad46', '>i4'), ('corzin_cw', s2d), ('pad47', '>i4'), 
+                    ('pad48', '>i4'), ('hscalesin_cw', s2d), ('pad49', '>i4'), 
+                    ('pad50', '>i4'), ('vscalesin_cw', s2d), ('pad51', '>i4'), 
+               
+                    ('pad52', '>i4'), ('ps', 'S5'), ('sig_ps', '>i4'), ('pad53', '>i4'), 
+                    ('pad54', '>i4'), ('corpin_ps', tnlat), ('pad55', '>i4'), 
+                    ('pad56', '>i4'), ('hscalespin_ps', tnlat), ('pad57', '>i4'), 
+               
+                    ('pad58', '>i4'), ('sst', 'S5'), ('sig_sst', '>i4'), ('pad59', '>i4'),
+                    ('pad60', '>i4'), ('corsstin_sst', sst2d), ('pad61', '>i4'), 
+                    ('pad62', '>i4'), ('hsstin_ps', sst2d), ('pad63', '>i4') ]   
+
+    return np.dtype(dt)#, align=True) # align=True should be automatic (?) 
+                                      # accounts for 4 bytes padding (before and after the records)
+
+# This function returns the dtypes (as strings, eg. '>i4') of the record markers, integers and reals of a layout
+def layout_dtypes(layout):
+
+    return (layout.byteorder + 'i' + str(layout.marker),
+            layout.byteorder + 'i' + str(layout.integer),
+            layout.byteorder + 'f' + str(layout.real))
+
+# This function reads an integer (of a given dtype) at a byte offset of an opened file; None if the file ends before
+def _read_int(fobj, offset, dtype):
+
+    dtype = np.dtype(dtype)
+
+    fobj.seek(offset)
+    buf = fobj.read(dtype.itemsize)
+
+    if len(buf) < dtype.itemsize:
+        return None
+
+    return int(np.frombuffer(buf, dtype=dtype)[0])
+
+# This function detects the layout of an opened .gcv file from its first records: the byte order and the size of the
+# record markers are the ones that give a header record of 3 integers (4 or 8 bytes) with matching markers, the size
+# of the reals is given by the size of the regression coefficients record and the control variables are read from
+# their tags (the other records are skipped with seeks, reading only their markers). It returns the layout and the
+# dimensions (nlev, nlat, nlon)
+def detect_layout(fobj):
+
+    for byteorder in ('>', '<'):
+        for marker in (4, 8):
+
+            mdt = byteorder + 'i' + str(marker)
+
+            nbytes = _read_int(fobj, 0, mdt)
+
+            if nbytes not in (12, 24) or _read_int(fobj, marker + nbytes, mdt) != nbytes:
+                continue
+
+            idt = byteorder + 'i' + str(nbytes // 3)
+
+            fobj.seek(marker)
+            nlev, nlat, nlon = (int(n) for n in np.frombuffer(fobj.read(nbytes), dtype=idt))
+
+            if min(nlev, nlat, nlon) > 0:
+                break
+        else:
+            continue
+        break
+    else:
+        raise ValueError('Unknown layout: the first record is not a header with the dimensions (nlev, nlat, nlon)')
+
+    integer = nbytes // 3
+
+    # Regression coefficients record
+    pos = 2*marker + nbytes
+
+    nbytes = _read_int(fobj, pos, mdt)
+    nvals = sum(record_size(var, nlat, nlon, nlev) for var in balprojs_names)
+
+    if nbytes is None or nbytes % nvals != 0 or nbytes // nvals not in (4, 8):
+        raise ValueError('Unexpected size of the regression coefficients record: ' + str(nbytes) + ' bytes')
+
+    real = nbytes // nvals
+
+    pos += 2*marker + nbytes
+
+    # Control variables (tags), skipping their records
+    variables = []
+    qin = False
+
+    while True:
+
+        nbytes = _read_int(fobj, pos, mdt)
+
+        if nbytes is None:
+            break
+
+        fobj.seek(pos + marker)
+        var = fobj.read(5).decode('ascii', errors='replace').strip()
+
+        if var not in hscales_var_names:
+            raise ValueError('Unknown control variable ' + repr(var) + ' at byte ' + str(pos))
+
+        variables.append(var)
+
+        pos += 2*marker + nbytes
+
+        for i in range(3 if var in vscales_var_names else 2):
+
+            nbytes = _read_int(fobj, pos, mdt)
+
+            if nbytes is None:
+                break
+
+            if i == 0 and var == 'q':
+                qin = nbytes == 2*real*record_size(var, nlat, nlon, nlev)
+
+            pos += 2*marker + nbytes
+
+    fobj.seek(0)
+
+    return Layout(byteorder, marker, integer, real, tuple(variables), qin), (nlev, nlat, nlon)
+
+# This function returns the variables of the records of each kind ('balprojs', 'amplitudes', 'hscales' and 'vscales')
+# of a file with a given layout (see detect_layout), in the order of the dictionaries of the names of the records
+def layout_vars(layout):
+
+    return {'balprojs': list(balprojs_names),
+            'amplitudes': [var for var in amplitudes_names if var in layout.vars or 
+                           (var == 'qin' and layout.qin and 'q' in layout.vars)],
+            'hscales': [var for var in hscales_var_names if var in layout.vars],
+            'vscales': [var for var in vscales_var_names if var in layout.vars]}
+
+# This function returns the variables of the records of each kind that are in all the given .gcv files (see
+# layout_vars); the layout of each file is detected from its first records
+def common_vars(file_names):
+
+    result = None
+
+    for file_name in file_names:
+
+        with open(file_name, 'rb') as fobj:
+            fvars = layout_vars(detect_layout(fobj)[0])
+
+        if result is None:
+            result = fvars
+        else:
+            result = {kind: [var for var in result[kind] if var in fvars[kind]] for kind in result}
+
+    return result
+
+# This function returns the structure of the whole file (after the first record marker) as a numpy dtype for a given
+# layout (see detect_layout); the default layout gives the dtype of records_dtype and the dtypes are cached
+@functools.lru_cache(maxsize=32)
+def layout_dtype(nlat, nlon, nlev, layout=default_layout):
+
+    if layout == default_layout:
+        return records_dtype(nlat, nlon, nlev)
+
+    mdt, idt, rdt = layout_dtypes(layout)
+
+    pads = iter(range(1, 1000))
+
+    # This function returns the fields of a record (leading marker, values and trailing marker)
+    def record(*fields):
+        return [('pad' + str(next(pads)), mdt)] + list(fields) + [('pad' + str(next(pads)), mdt)]
+
+    # The leading marker of the header is not part of the structure (as in records_dtype)
+    dt = [('grid', '3' + idt), ('pad' + str(next(pads)), mdt)]
+
+    dt += record(*[(var, str(record_size(var, nlat, nlon, nlev)) + rdt) for var in balprojs_names])
+
+    for var in layout.vars:
+
+        shape = str(record_size(var, nlat, nlon, nlev)) + rdt
+
+        dt += record((var, 'S5'), ('sig_' + var, idt))
+
+        if var == 'q' and layout.qin:
+            dt += record((amplitudes_names['q'], shape), (amplitudes_names['qin'], shape))
+        else:
+            dt += record((amplitudes_names[var], shape))
+
+        dt += record((hscales_var_names[var], shape))
+
+        if var in vscales_var_names:
+            dt += record((vscales_var_names[var], shape))
+
+    return np.dtype(dt)
+
+# This function converts an array read from the file (big endian) to the native byte order; the bytes are swapped
+# in place and a view with the native dtype is returned, so no copy of the array is made
+def to_native(data):
+
+    if data.dtype.isnative:
+        return data
+
+    return data.byteswap(inplace=True).view(data.dtype.newbyteorder('='))
+
+# This function reads one Fortran unformatted record (4 bytes length marker, data, 4 bytes length marker) and
+# returns a tuple with (byte offset of the data, number of bytes, data), or None at the end of the file; if read
+# is False, the data is skipped (with a seek) and returned as None
+def read_fortran_record(fobj, read=True, marker='>i4'):
+
+    msize = np.dtype(marker).itemsize
+
+    head = fobj.read(msize)
+
+    if len(head) == 0:
+        return None
+    elif len(head) < msize:
+        raise ValueError('Truncated record marker at byte ' + str(fobj.tell() - len(head)))
+
+    nbytes = int(np.frombuffer(head, dtype=marker)[0])
+    offset = fobj.tell()
+
+    if read:
+        data = fobj.read(nbytes)
+        ndata = len(data)
+    else:
+        data = None
+        ndata = min(nbytes, max(fobj.seek(0, 2) - offset, 0))
+        fobj.seek(offset + ndata)
+
+    tail = fobj.read(msize)
+
+    if ndata < nbytes or len(tail) < msize:
+        raise ValueError('Truncated record of ' + str(nbytes) + ' bytes at byte ' + str(offset - msize))
+
+    if int(np.frombuffer(tail, dtype=marker)[0]) != nbytes:
+        raise ValueError('Leading and trailing record markers do not match (' + str(nbytes) + ' bytes) at byte ' + str(offset - msize))
+
+    return offset, nbytes, data
+
+# This function walks the Fortran records of an opened .gcv file and yields tuples with (variable name, record kind,
+# byte offset, number of values, flat array); the first tuple is ('grid', 'header', offset, 3, [nlev, nlat, nlon])
+# and each control variable starts with a (var, 'tag', offset, 1, [number of levels]) tuple. If read is False, only
+# the header and the tags of the control variables are read and the arrays of the other records are None. The layout
+# of the file (see detect_layout) is detected if it isn't given
+def scan_records(fobj, read=True, layout=None):
+
+    if layout is None:
+        layout = detect_layout(fobj)[0]
+
+    mdt, idt, rdt = layout_dtypes(layout)
+
+    rec = read_fortran_record(fobj, marker=mdt)
+
+    if rec is None:
+        raise ValueError('Empty file')
+
+    grid = np.frombuffer(rec[2], dtype=idt)
+
+    nlev, nlat, nlon = (int(n) for n in grid[:3])
+
+    yield 'grid', 'header', rec[0], grid.size, grid
+
+    # Regression coefficients - agvin, bgvin and wgvin are written in a single record
+    rec = read_fortran_record(fobj, read, marker=mdt)
+
+    if rec is None:
+        raise ValueError('Missing regression coefficients record')
+
+    sizes = [record_size(var, nlat, nlon, nlev) for var in balprojs_names]
+
+    rsize = layout.real
+
+    if rec[1] != rsize*sum(sizes):
+        raise ValueError('Unexpected size of the regression coefficients record: ' + str(rec[1]//rsize) + ' values')
+
+    offset = rec[0]
+
+    for var, size in zip(balprojs_names, sizes):
+        if read:
+            yield var, 'balprojs', offset, size, np.frombuffer(rec[2], dtype=rdt, count=size, offset=offset-rec[0])
+        else:
+            yield var, 'balprojs', offset, size, None
+        offset += rsize*size
+
+    del rec
+
+    # Control variables - one record with the name of the variable and the number of levels, followed by
+    # the records with the amplitudes, horizontal length scales and vertical length scales (not for ps and sst)
+    while True:
+
+        tag = read_fortran_record(fobj, marker=mdt)
+
+        if tag is None:
+            break
+
+        var = tag[2][:5].decode('ascii', errors='replace').strip()
+
+        if var not in hscales_var_names:
+            raise ValueError('Unknown control variable ' + repr(var) + ' at byte ' + str(tag[0] - layout.marker))
+
+        yield var, 'tag', tag[0], 1, np.frombuffer(tag[2], dtype=idt, count=1, offset=5)
+
+        size = record_size(var, nlat, nlon, nlev)
+
+        kinds = ['amplitudes', 'hscales']
+
+        if var in vscales_var_names:
+            kinds.append('vscales')
+
+        for kind in kinds:
+
+            rec = read_fortran_record(fobj, read, marker=mdt)
+
+            if rec is None:
+                raise ValueError('Missing ' + kind + ' record for the control variable ' + repr(var))
+
+            # For q, the amplitudes record also has the normalized relative humidity amplitudes (qin)
+            if kind == 'amplitudes' and var == 'q' and rec[1] == 2*rsize*size:
+                names = ['q', 'qin']
+            elif rec[1] == rsize*size:
+                names = [var]
+            else:
+                raise ValueError('Unexpected size of the ' + kind + ' record for ' + repr(var) + ': ' + str(rec[1]//rsize) + ' values')
+
+            for i, name in enumerate(names):
+                if read:
+                    yield name, kind, rec[0] + rsize*i*size, size, np.frombuffer(rec[2], dtype=rdt, count=size, offset=rsize*i*size)
+                else:
+                    yield name, kind, rec[0] + rsize*i*size, size, None
+
+# This function walks the Fortran records of a .gcv file, one record at a time, and yields tuples with
+# (variable name, record kind, flat array); the first tuple is ('grid', 'header', [nlev, nlat, nlon]) and
+# each control variable starts with a (var, 'tag', [number of levels]) tuple
+def iter_records(file_name):
+
+    with open(file_name, 'rb') as fobj:
+        for var, kind, offset, size, data in scan_records(fobj):
+            yield var, kind, data
+
+# This function writes a list of Fortran unformatted records to a file; each record is a list of (dtype, array) pieces,
+# with the arrays in the Fortran order of the axes. The whole file is built in a single buffer (record markers and
+# big endian values) and written at once
+def write_fortran_records(file_name, recs):
+
+    sizes = [sum(np.dtype(dt).itemsize*np.size(values) for dt, values in rec) for rec in recs]
+
+    buf = np.empty(sum(sizes) + 8*len(recs), dtype=np.uint8)
+
+    pos = 0
+
+    for rec, nbytes in zip(recs, sizes):
+
+        buf[pos:pos+4].view('>i4')[0] = nbytes
+        pos += 4
+
+        for dt, values in rec:
+            dt = np.dtype(dt)
+            n = dt.itemsize*np.size(values)
+            np.reshape(buf[pos:pos+n].view(dt), np.shape(values), order='F')[...] = values
+            pos += n
+
+        buf[pos:pos+4].view('>i4')[0] = nbytes
+        pos += 4
+
+    with open(file_name, 'wb') as fobj:
+        buf.tofile(fobj)
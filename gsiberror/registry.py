@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from .index import file_key
+
+# Memory budget (bytes) of the matrices kept by the registry (default: 2 GiB)
+_budget = 2*2**30
+
+# Matrices kept by the registry, from the least to the most recently used: (name, options) -> (key, Berror, bytes)
+_entries = OrderedDict()
+
+# Lock of the registry and locks of the files being read (the same file is read only once at the same time)
+_lock = threading.RLock()
+_file_locks = {}
+
+# This function returns the number of bytes of the records of a Berror object
+def berror_nbytes(bfile):
+
+    return sum(da.nbytes for kind in ['balprojs', 'amplitudes', 'hscales', 'vscales']
+               for da in getattr(bfile, kind, {}).values())
+
+# This function removes the least recently used matrices until the total size is within the budget; the lock of the
+# registry must be held
+def _evict():
+
+    total = sum(entry[2] for entry in _entries.values())
+
+    while _entries and total > _budget:
+        _, entry = _entries.popitem(last=False)
+        total -= entry[2]
+
+def open_matrix(file_name, lazy=False, index=False, native=False):
+    """
+    open
+    ----
+
+    This function returns a Berror object with the records of a .gcv file read (see the read_records method), shared
+    by all the calls with the same file and options: the matrices are kept in a registry (for the whole process) and
+    the same object is returned while the size and the modification time of the file don't change. The registry has a
+    memory budget (see set_memory_budget) and the least recently used matrices are removed when it is exceeded. It can
+    be used by several threads at the same time (each file is read only once). Since the objects are shared, their
+    records must not be changed (eg., use bfile.hscales['sf']*1.2 instead of bfile.hscales['sf'][:] *= 1.2).
+
+    Input parameters
+    ----------------
+        file_name: name of the file
+        lazy     : as in the read_records method (default: False)
+        index    : as in the read_records method (default: False)
+        native   : as in the read_records method (default: False)
+
+    Result
+    ------
+        bfile: Berror object with the records read
+
+    Use
+    ---
+        import gsiberror as gb
+
+        bfile = gb.open('arquivo_matriz_B.gcv')
+
+        bfile is gb.open('arquivo_matriz_B.gcv')   # True
+    """
+
+    from . import Berror
+
+    name = os.path.abspath(os.fspath(file_name))
+
+    options = (bool(lazy), bool(index), bool(native))
+
+    with _lock:
+        file_lock = _file_locks.setdefault(name, threading.Lock())
+
+    with file_lock:
+
+        key = file_key(name)
+
+        with _lock:
+            entry = _entries.get((name, options))
+            if entry is not None and entry[0] == key:
+                _entries.move_to_end((name, options))
+                return entry[1]
+
+        bfile = Berror(file_name)
+        bfile.read_records(lazy=lazy, index=index, native=native)
+
+        nbytes = berror_nbytes(bfile)
+
+        with _lock:
+            _entries.pop((name, options), None)
+            if nbytes <= _budget:
+                _entries[(name, options)] = (key, bfile, nbytes)
+                _evict()
+
+    return bfile
+
+# This function sets the memory budget (bytes) of the registry, removing the least recently used matrices if needed
+def set_memory_budget(nbytes):
+
+    global _budget
+
+    with _lock:
+        _budget = int(nbytes)
+        _evict()
+
+# This function removes all the matrices from the registry
+def clear_registry():
+
+    with _lock:
+        _entries.clear()
+
+# This function returns a list with the name of the file, the options (lazy, index, native) and the size (bytes) of
+# each matrix in the registry, from the least to the most recently used
+def registry_info():
+
+    with _lock:
+        return [{'file': name, 'options': options, 'nbytes': entry[2]} for (name, options), entry in _entries.items()]
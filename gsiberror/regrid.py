@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+import functools
+import numpy as np
+import xarray as xr
+
+# This function returns the matrix (target points x source points) of the weights of the linear interpolation between
+# two (increasing) sets of coordinates; the target points outside the source coordinates take the nearest values
+def interp_weights(src, tgt):
+
+    return _interp_weights(tuple(np.asarray(src, dtype=np.float64).tolist()), tuple(np.asarray(tgt, dtype=np.float64).tolist()))
+
+# The weights are cached by the source and target coordinates, so that they are computed once for all the records
+# (and matrices) with the same grids
+@functools.lru_cache(maxsize=64)
+def _interp_weights(src, tgt):
+
+    src = np.asarray(src)
+    tgt = np.clip(np.asarray(tgt), src[0], src[-1])
+
+    weights = np.zeros((tgt.size, src.size))
+
+    if src.size == 1:
+        weights[:, 0] = 1.
+        return weights
+
+    idx = np.clip(np.searchsorted(src, tgt, side='right') - 1, 0, src.size - 2)
+    frac = (tgt - src[idx]) / (src[idx+1] - src[idx])
+
+    rows = np.arange(tgt.size)
+
+    weights[rows, idx] = 1. - frac
+    weights[rows, idx+1] += frac
+
+    weights.flags.writeable = False
+
+    return weights
+
+# This function returns the pseudo-inverse of the weights of the interpolation between two sets of coordinates; it is
+# applied to the index of agvin that multiplies the stream function (level_2), so that the interpolated regression
+# coefficients applied to the interpolated stream function give the interpolated balanced part
+@functools.lru_cache(maxsize=64)
+def _pinv_weights(src, tgt):
+
+    weights = np.linalg.pinv(_interp_weights(src, tgt)).T
+
+    weights.flags.writeable = False
+
+    return weights
+
+# This function applies the weights to the given axis of an array (the other axes are batched)
+def apply_weights(weights, data, axis):
+
+    return np.moveaxis(np.tensordot(weights, data, axes=(1, axis)), 0, axis)
+
+# This function interpolates all the records of a Berror object to a new grid and returns a new Berror object; the
+# records with the same dimensions are stacked and interpolated at once
+def regrid_records(bfile, lats, lons, levs):
+
+    from . import Berror
+
+    src = {'latitude': np.asarray(bfile.lats, dtype=np.float64),
+           'longitude': np.asarray(bfile.lons, dtype=np.float64),
+           'level': np.asarray(bfile.levs, dtype=np.float64)}
+
+    tgt = {'latitude': np.asarray(lats, dtype=np.float64),
+           'longitude': np.asarray(lons, dtype=np.float64),
+           'level': np.asarray(levs, dtype=np.float64)}
+
+    # Weights of each dimension (level_2 is the level index of agvin that multiplies the stream function)
+    weights = {dim: interp_weights(src[dim], tgt[dim]) for dim in src}
+    weights['level_2'] = _pinv_weights(tuple(src['level'].tolist()), tuple(tgt['level'].tolist()))
+
+    # The vertical length scales are given in grid units and are stretched by the ratio between the new and old
+    # spacing of the levels (eg., they are doubled if the number of levels is doubled)
+    stretch = 1. / np.gradient(tgt['level']) if tgt['level'].size > 1 else np.ones(1)
+
+    new = Berror(bfile.file_name)
+
+    new._set_grid(tgt['level'].size, tgt['latitude'].size, tgt['longitude'].size, lats=tgt['latitude'], lons=tgt['longitude'])
+
+    new.sigs = {var: (new.nlev if isig == bfile.nlev else isig) for var, isig in getattr(bfile, 'sigs', {}).items()}
+
+    new.amplitudes_names = dict(bfile.amplitudes_names)
+    new.hscales_var_names = dict(bfile.hscales_var_names)
+    new.vscales_var_names = dict(bfile.vscales_var_names)
+
+    coords = {'latitude': new.lats, 'longitude': new.lons, 'level': new.levs, 'level_2': new.levs}
+
+    # Records grouped by their dimensions
+    groups = {}
+
+    for kind in ['balprojs', 'amplitudes', 'hscales', 'vscales']:
+        setattr(new, kind, {})
+        for var, da in getattr(bfile, kind).items():
+            groups.setdefault(da.dims, []).append((kind, var, da))
+
+    for dims, recs in groups.items():
+
+        data = np.stack([np.asarray(da.values, dtype=np.float64) for kind, var, da in recs])
+
+        for axis, dim in enumerate(dims, start=1):
+            data = apply_weights(weights[dim], data, axis)
+
+        for (kind, var, da), values in zip(recs, data):
+
+            if kind == 'vscales':
+                values = values * stretch.reshape((-1,) + (1,)*(values.ndim - 1))
+
+            getattr(new, kind)[var] = xr.DataArray(values.astype(np.float32), dims=dims,
+                                                   coords={dim: coords[dim] for dim in dims}, name=da.name)
+
+    return new
@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .records import amplitudes_names, hscales_var_names, vscales_var_names, balprojs_names, common_vars
+
+# Matrices read by each worker process of the report (read once, when the worker starts)
+_matrices = []
+
+# This function returns the list of figures (plotting tasks) of the report; each task is a tuple with the kind of
+# the record, the name of the variable and the level (only for agvin, None for the others). The variables of each
+# kind are given by a dictionary (see common_vars in records.py; default: all the variables)
+def report_tasks(agvin_levels=(0,), variables=None):
+
+    if variables is None:
+        variables = {'balprojs': balprojs_names, 'amplitudes': amplitudes_names, 'hscales': hscales_var_names,
+                     'vscales': vscales_var_names}
+
+    tasks = []
+
+    for var in variables['balprojs']:
+        if var == 'agvin':
+            tasks.extend(('balprojs', var, lev) for lev in agvin_levels)
+        else:
+            tasks.append(('balprojs', var, None))
+
+    tasks.extend(('amplitudes', var, None) for var in variables['amplitudes'])
+    tasks.extend(('hscales', var, None) for var in variables['hscales'])
+    tasks.extend(('vscales', var, None) for var in variables['vscales'])
+
+    return tasks
+
+# This function returns the name of the figure of a task
+def report_figname(kind, var, lev):
+
+    if kind == 'balprojs':
+        if lev is None:
+            return 'reg_coeffs_' + str(var) + '.png'
+        return 'reg_coeffs_' + str(var) + '_' + str(lev) + '.png'
+
+    return str(kind) + '_' + str(var) + '.png'
+
+# This function starts a worker process of the report: the headless (Agg) backend of matplotlib is selected and the
+# matrices are read
+def _init_worker(file_names, names):
+
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend('Agg')
+
+    from . import Berror
+
+    for file_name, name in zip(file_names, names):
+        bfile = Berror(file_name)
+        bfile.read_records(native=True)
+        bfile.my_name(name)
+        _matrices.append(bfile)
+
+# This function plots the figure of a task (in a worker process) and returns the name of the figure
+def _render_task(task, outdir, suptitle):
+
+    import matplotlib.pyplot as plt
+
+    from .plot_functions import plot_reg_coeffs, plot_amplitudes, plot_hscales, plot_vscales
+
+    kind, var, lev = task
+
+    figname = os.path.join(outdir, report_figname(kind, var, lev))
+
+    if kind == 'balprojs':
+        plot_reg_coeffs(_matrices, var, lev if lev is not None else 0, suptitle=suptitle, savefig=True, figname=figname)
+    elif kind == 'amplitudes':
+        plot_amplitudes(_matrices, var, suptitle=suptitle, savefig=True, figname=figname)
+    elif kind == 'hscales':
+        plot_hscales(_matrices, var, suptitle=suptitle, savefig=True, figname=figname)
+    elif kind == 'vscales':
+        plot_vscales(_matrices, var, suptitle=suptitle, savefig=True, figname=figname)
+
+    plt.close('all')
+
+    return figname
+
+def render_report(file_names, outdir, names=None, workers=None, agvin_levels=(0,), suptitle=True):
+    """
+    render_report
+    -------------
+
+    This function plots the full set of figures (regression coefficients, amplitudes, horizontal and vertical length
+    scales of all the variables found in all the matrices) for a list of background error covariance matrices. The
+    figures are plotted in parallel by a pool of processes (one figure per task), with the headless backend of 
+    matplotlib (Agg), and saved in the output directory (eg., outdir/amplitudes_sf.png).
+
+    Input parameters
+    ----------------
+        file_names  : list with the names of the files of the matrices (compared side by side in each figure)
+        outdir      : directory where the figures are saved (created if it doesn't exist)
+        names       : list with the names of the matrices used in the titles (default: the names of the files)
+        workers     : number of processes (default: the number of CPUs)
+        agvin_levels: levels (level_2 indexes) used in the figures of agvin (default: (0,))
+        suptitle    : if True, the figures have a title (default: True)
+
+    Result
+    ------
+        list with the names of the saved figures
+
+    Use
+    ---
+        import gsiberror as gb
+
+        gb.render_report(['arquivo_matriz_B1.gcv', 'arquivo_matriz_B2.gcv'], 'figuras', workers=4)
+    """
+
+    file_names = [os.fspath(file_name) for file_name in file_names]
+
+    if names is None:
+        names = [os.path.basename(file_name) for file_name in file_names]
+
+    os.makedirs(outdir, exist_ok=True)
+
+    # Only the variables found in all the matrices (eg., the figures of oz and cw are skipped if a matrix doesn't have
+    # them)
+    tasks = report_tasks(agvin_levels, common_vars(file_names))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(file_names, names)) as executor:
+        fignames = list(executor.map(_render_task, tasks, [outdir]*len(tasks), [suptitle]*len(tasks)))
+
+    return fignames
@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+from .index import file_key
+from .records import common_vars
+
+# Kinds of records that can be plotted
+plot_kinds = ['amplitudes', 'hscales', 'vscales', 'balprojs']
+
+# This function starts a worker process of the service (the headless backend of matplotlib is selected)
+def _init_worker():
+
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend('Agg')
+
+# This function plots a figure (in a worker process) and saves it with the given name; the matrices are read once by
+# each worker (see the open function) and the figure is written to a temporary file and then renamed, so that a
+# figure in the cache is always complete
+def render_figure(file_names, kind, var, lev, eqrange, figname):
+
+    import matplotlib.pyplot as plt
+
+    from .registry import open_matrix
+    from .plot_functions import plot_reg_coeffs, plot_amplitudes, plot_hscales, plot_vscales
+
+    bfiles = []
+
+    for file_name in file_names:
+        bfile = open_matrix(file_name, native=True)
+        # The objects are shared by the calls (see the open function) and the name is set only once (my_name is
+        # replaced by the name)
+        if callable(bfile.my_name):
+            bfile.my_name(os.path.basename(file_name))
+        bfiles.append(bfile)
+
+    tmpname = figname + '.' + str(os.getpid()) + '.tmp.png'
+
+    kwargs = {'eqrange': eqrange, 'suptitle': True, 'savefig': True, 'figname': tmpname}
+
+    try:
+        if kind == 'balprojs':
+            plot_reg_coeffs(bfiles, var, lev, **kwargs)
+        elif kind == 'amplitudes':
+            plot_amplitudes(bfiles, var, **kwargs)
+        elif kind == 'hscales':
+            plot_hscales(bfiles, var, **kwargs)
+        elif kind == 'vscales':
+            plot_vscales(bfiles, var, **kwargs)
+        os.replace(tmpname, figname)
+    finally:
+        plt.close('all')
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+    return figname
+
+class PlotService(object):
+    """
+    PlotService
+    ===========
+
+    Class of a local HTTP service that plots the records of the matrices (.gcv files) of a directory on demand. The
+    figures are plotted by a pool of processes (the event loop is not blocked) and kept in a cache directory, with
+    names given by the fingerprints of the files (name, size and modification time) and the options of the figure;
+    the least recently used figures are removed when the size of the cache exceeds its limit.
+
+    Requests
+    --------
+        GET /
+            list (json) of the matrices of the directory and the variables of each kind of record of each matrix
+            (None if the layout of the file can't be detected)
+
+        GET /plot?matrix=<file>[,<file>...]&kind=<amplitudes|hscales|vscales|balprojs>&var=<var>[&lev=<level_2>][&eqrange=1]
+            figure (png) of the record of the matrices (side by side); lev is the level of agvin (default: 0) and
+            eqrange=1 uses the same range of values for all the matrices
+
+    Use
+    ---
+        python -m gsiberror.serve data/ --port 8050
+
+        http://127.0.0.1:8050/plot?matrix=global_berror.l64y386.f77-ncep-dtc.gcv&kind=amplitudes&var=sf
+
+    """
+
+    def __init__(self, data_dir, cache_dir=None, cache_size=500*2**20, workers=None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.cache_dir = os.path.abspath(cache_dir if cache_dir is not None else os.path.join(data_dir, '.plot_cache'))
+        self.cache_size = int(cache_size)
+        self.workers = workers
+        self.executor = None
+        self._pending = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # This method returns the names of the .gcv files of the directory
+    def matrices(self):
+
+        return sorted(name for name in os.listdir(self.data_dir) if name.endswith('.gcv'))
+
+    # This method returns the list of the matrices and the variables of each kind of record of each matrix (see
+    # common_vars in records.py)
+    def listing(self):
+
+        names = self.matrices()
+
+        variables = {}
+
+        for name in names:
+            try:
+                variables[name] = common_vars([os.path.join(self.data_dir, name)])
+            except (OSError, ValueError):
+                variables[name] = None
+
+        return {'matrices': names, 'vars': variables}
+
+    # This method checks the parameters of a plot request and returns the files and the options of the figure; the
+    # variable must be in all the matrices (their layouts are detected from their first records)
+    def plot_options(self, query):
+
+        names = [name for value in query.get('matrix', []) for name in value.split(',') if name]
+
+        if not names:
+            raise ValueError('The matrix parameter is required')
+
+        available = set(self.matrices())
+
+        for name in names:
+            if name not in available:
+                raise ValueError('Unknown matrix: ' + repr(name))
+
+        kind = query.get('kind', ['amplitudes'])[0]
+
+        if kind not in plot_kinds:
+            raise ValueError('Unknown kind of record: ' + repr(kind))
+
+        file_names = [os.path.join(self.data_dir, name) for name in names]
+
+        variables = common_vars(file_names)[kind]
+
+        var = query.get('var', [''])[0]
+
+        if var not in variables:
+            raise ValueError('Unknown variable ' + repr(var) + ' for ' + kind + ' in the matrices (one of ' +
+                             ', '.join(variables) + ')')
+
+        lev = int(query.get('lev', ['0'])[0])
+
+        eqrange = query.get('eqrange', ['0'])[0].lower() in ('1', 'true', 'yes')
+
+        return file_names, kind, var, lev, eqrange
+
+    # This method returns the name of the figure in the cache, given by the fingerprints of the files and the options
+    def figure_path(self, file_names, kind, var, lev, eqrange):
+
+        fingerprint = [(os.path.basename(file_name), file_key(file_name)['size'], file_key(file_name)['mtime_ns'])
+                       for file_name in file_names]
+
+        key = json.dumps([fingerprint, kind, var, lev if var == 'agvin' else None, eqrange])
+
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.png')
+
+    # This method removes the least recently used figures (by modification time, updated when a figure is served)
+    # until the size of the cache is within its limit; the figure given by keep is not removed
+    def evict(self, keep=None):
+
+        figures = []
+
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.png') and not name.endswith('.tmp.png') and path != keep:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                figures.append((st.st_mtime_ns, st.st_size, path))
+
+        total = sum(size for _, size, _ in figures)
+
+        if keep is not None and os.path.exists(keep):
+            total += os.path.getsize(keep)
+
+        for _, size, path in sorted(figures):
+            if total <= self.cache_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    # This method plots a figure with the pool of processes and returns its contents (read before the eviction of the
+    # least recently used figures)
+    async def render(self, file_names, kind, var, lev, eqrange, figname):
+
+        loop = asyncio.get_running_loop()
+
+        await loop.run_in_executor(self.executor, render_figure, file_names, kind, var, lev, eqrange, figname)
+
+        with open(figname, 'rb') as fobj:
+            data = fobj.read()
+
+        await loop.run_in_executor(None, self.evict, figname)
+
+        return data
+
+    # This method returns the contents of the figure of a plot request (from the cache or plotted by the pool of
+    # processes); the requests of the same figure at the same time wait for a single plot
+    async def figure(self, file_names, kind, var, lev, eqrange):
+
+        figname = self.figure_path(file_names, kind, var, lev, eqrange)
+
+        pending = self._pending.get(figname)
+
+        if pending is None:
+            try:
+                with open(figname, 'rb') as fobj:
+                    data = fobj.read()
+                os.utime(figname)
+                return data
+            except FileNotFoundError:
+                pass
+
+            pending = asyncio.ensure_future(self.render(file_names, kind, var, lev, eqrange, figname))
+            self._pending[figname] = pending
+            pending.add_done_callback(lambda fut: self._pending.pop(figname, None))
+
+        return await asyncio.shield(pending)
+
+    # This method handles a request and returns the status, the content type and the body of the response
+    async def handle_request(self, method, target):
+
+        if method != 'GET':
+            return 405, 'text/plain', b'Method not allowed'
+
+        url = urlsplit(target)
+
+        # The files are read (layouts of the matrices) by the default pool of threads of the event loop
+        loop = asyncio.get_running_loop()
+
+        if url.path == '/':
+            body = await loop.run_in_executor(None, self.listing)
+            return 200, 'application/json', json.dumps(body).encode()
+
+        if url.path == '/plot':
+            try:
+                options = await loop.run_in_executor(None, self.plot_options, parse_qs(url.query))
+            except (OSError, ValueError) as err:
+                return 400, 'text/plain', str(err).encode()
+
+            try:
+                data = await self.figure(*options)
+            except Exception as err:
+                return 500, 'text/plain', ('Error plotting the figure: ' + str(err)).encode()
+
+            return 200, 'image/png', data
+
+        return 404, 'text/plain', b'Not found'
+
+    # This method reads a request (HTTP/1.x, only the request line and the headers are used) and writes the response
+    async def handle_connection(self, reader, writer):
+
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                   500: 'Internal Server Error'}
+
+        try:
+            line = await reader.readline()
+
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+
+            parts = line.decode('latin-1').split()
+
+            if len(parts) < 2:
+                status, ctype, body = 400, 'text/plain', b'Bad request'
+            else:
+                status, ctype, body = await self.handle_request(parts[0], parts[1])
+
+            writer.write(('HTTP/1.1 ' + str(status) + ' ' + reasons[status] + '\r\n' +
+                          'Content-Type: ' + ctype + '\r\n' +
+                          'Content-Length: ' + str(len(body)) + '\r\n' +
+                          'Connection: close\r\n\r\n').encode('latin-1') + body)
+
+            await writer.drain()
+        finally:
+            writer.close()
+
+    # This method starts the pool of processes and serves the requests until it is cancelled
+    async def serve(self, host='127.0.0.1', port=8050):
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+        try:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m gsiberror.serve',
+                                     description='Local HTTP service that plots the records of the .gcv files of a directory')
+
+    parser.add_argument('data_dir', help='directory with the .gcv files')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the service (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8050, help='port of the service (default: 8050)')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: the number of CPUs)')
+    parser.add_argument('--cache-dir', default=None, help='directory of the figures (default: data_dir/.plot_cache)')
+    parser.add_argument('--cache-size', type=float, default=500., help='size limit of the cache in MiB (default: 500)')
+
+    args = parser.parse_args(argv)
+
+    service = PlotService(args.data_dir, cache_dir=args.cache_dir, cache_size=args.cache_size*2**20,
+                          workers=args.workers)
+
+    print('Serving the matrices of ' + service.data_dir + ' at http://' + args.host + ':' + str(args.port) + '/')
+
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
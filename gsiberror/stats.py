@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+
+import warnings
+import numpy as np
+
+from collections.abc import Mapping
+
+# Names of the statistics computed for each record
+stats_names = ['min', 'max', 'mean', 'std', 'nan']
+
+# This function computes the minimum and maximum of an array, ignoring the NaN values; the plain reductions (fast,
+# without temporary arrays) are used and the NaN-aware ones only if a NaN value is found (it propagates to the result)
+def minmax_stats(values):
+
+    values = np.asarray(values)
+
+    if values.size == 0:
+        return {'min': np.nan, 'max': np.nan}
+
+    vmin = values.min()
+    vmax = values.max()
+
+    if np.isnan(vmin) or np.isnan(vmax):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            vmin = np.nanmin(values)
+            vmax = np.nanmax(values)
+
+    return {'min': float(vmin), 'max': float(vmax)}
+
+# This function computes the mean, standard deviation and number of NaN values of an array; the NaN values are
+# ignored by the mean and standard deviation, which are accumulated in double precision
+def moment_stats(values):
+
+    values = np.asarray(values)
+
+    nans = np.isnan(values)
+    nnan = int(np.count_nonzero(nans))
+
+    if nnan:
+        values = values[~nans]
+
+    if values.size == 0:
+        return {'mean': np.nan, 'std': np.nan, 'nan': nnan}
+
+    return {'mean': float(values.mean(dtype=np.float64)),
+            'std': float(values.std(dtype=np.float64)),
+            'nan': nnan}
+
+# This function computes the minimum, maximum, mean, standard deviation and number of NaN values of an array; the
+# NaN values are ignored by the other statistics and the mean and standard deviation are accumulated in double precision
+def array_stats(values):
+
+    values = np.asarray(values)
+
+    return {**minmax_stats(values), **moment_stats(values)}
+
+class RecordStats(Mapping):
+    """
+    RecordStats
+    ===========
+
+    Class with the statistics of a record (see array_stats), as a read-only dictionary computed on demand: the minimum
+    and maximum are computed together when one of them is first used (eg., by global_minmax) and the mean, standard
+    deviation and number of NaN values when one of them is first used. The record is given by an array or a xarray
+    DataArray (its values are taken when the statistics are computed).
+
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._stats = {}
+
+    def __getitem__(self, name):
+
+        if name not in stats_names:
+            raise KeyError(name)
+
+        if name not in self._stats:
+            values = getattr(self._data, 'values', self._data)
+            if name in ('min', 'max'):
+                self._stats.update(minmax_stats(values))
+            else:
+                self._stats.update(moment_stats(values))
+
+        return self._stats[name]
+
+    def __iter__(self):
+        return iter(stats_names)
+
+    def __len__(self):
+        return len(stats_names)
+
+    def __repr__(self):
+        return repr(dict(self))
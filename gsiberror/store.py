@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+
+import os
+import numpy as np
+import xarray as xr
+
+# This function returns the chunks of a record in the store: agvin is chunked by level (the regression coefficients
+# of one level are read at once) and the other records are kept in a single chunk
+def record_chunks(da):
+
+    if da.name == 'agvin':
+        return tuple(1 if dim == 'level' else size for dim, size in zip(da.dims, da.shape))
+
+    return da.shape
+
+# This function writes the records of a Berror object to a compressed and chunked NetCDF4 file
+def to_netcdf(bfile, file_name, complevel=4):
+
+    ds = bfile.to_dataset().astype(np.float32)
+
+    encoding = {name: {'zlib': True, 'complevel': complevel, 'shuffle': True, 'chunksizes': record_chunks(ds[name])}
+                for name in ds.data_vars}
+
+    ds.to_netcdf(file_name, engine='netcdf4', encoding=encoding)
+
+# This function writes the records of a Berror object to a chunked Zarr store (compressed with the default compressor
+# of Zarr)
+def to_zarr(bfile, store, mode='w'):
+
+    ds = bfile.to_dataset().astype(np.float32)
+
+    encoding = {name: {'chunks': record_chunks(ds[name])} for name in ds.data_vars}
+
+    ds.to_zarr(store, mode=mode, encoding=encoding)
+
+# This function opens a store written by to_netcdf or to_zarr (chosen by the name of the store: directories and names
+# ending with .zarr are opened as Zarr) and returns a Berror object with the records read lazily from the store
+def open_store(store, chunks=None):
+
+    from . import Berror
+
+    store = os.fspath(store)
+
+    if store.rstrip('/').endswith('.zarr') or os.path.isdir(store):
+        ds = xr.open_dataset(store, engine='zarr', chunks=chunks)
+    else:
+        ds = xr.open_dataset(store, chunks=chunks)
+
+    bfile = Berror(store)
+
+    bfile._from_dataset(ds)
+
+    return bfile
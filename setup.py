@@ -18,6 +18,9 @@ setup(
         'Cartopy==0.22.0',
         'matplotlib',
         ],
+    entry_points={
+        'xarray.backends': ['gsiberror = gsiberror.backend:GSIBerrorBackendEntrypoint'],
+        },
     extra_requires={'dev': ['twine>=4.0.2']},
     classifiers=[
         'Programming Language :: Python :: 3',
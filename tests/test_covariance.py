@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from gsiberror.benchmark import synthetic_berror
+
+# The B operator is built column by column (B applied to each unit vector) on a small grid: it must be symmetric and
+# its diagonal must be the square of the amplitudes
+@pytest.mark.parametrize('var', ['t', 'ps', 'sst'])
+def test_b_diagonal_is_amplitudes_squared(var):
+
+    nlat, nlon, nlev = 12, 24, 3
+
+    bfile = synthetic_berror(nlat, nlon, nlev, seed=1)
+
+    shape = (nlat, nlon) if var in ('ps', 'sst') else (nlev, nlat, nlon)
+    size = int(np.prod(shape))
+
+    bmat = bfile.apply_b(var, np.eye(size).reshape((size,) + shape)).reshape(size, size).astype(np.float64)
+
+    amp = np.asarray(bfile.amplitudes[var].values, dtype=np.float64)
+
+    if var == 'ps':
+        amp = np.broadcast_to(amp[:, None], shape)
+    elif var != 'sst':
+        amp = np.broadcast_to(amp[:, :, None], shape)
+
+    np.testing.assert_allclose(np.diag(bmat).reshape(shape), amp**2, rtol=1e-5)
+    np.testing.assert_allclose(bmat, bmat.T, rtol=0., atol=1e-5 * np.abs(bmat).max())
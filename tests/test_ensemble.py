@@ -0,0 +1,19 @@
+import pytest
+
+import gsiberror as gb
+from gsiberror.benchmark import synthetic_berror, write_synthetic
+
+# Matrices with different records (here, one without oz) can't be mixed, in any order and with any number of workers
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('order', [1, -1])
+def test_ensemble_stats_different_records(tmp_path, workers, order):
+
+    full = write_synthetic(str(tmp_path / 'full.gcv'), 10, 20, 4)
+
+    bfile = synthetic_berror(10, 20, 4, seed=1)
+    for kind in ['amplitudes', 'hscales', 'vscales']:
+        del getattr(bfile, kind)['oz']
+    bfile.to_gcv(str(tmp_path / 'nooz.gcv'))
+
+    with pytest.raises(ValueError):
+        gb.ensemble_stats([full, str(tmp_path / 'nooz.gcv')][::order], workers=workers)
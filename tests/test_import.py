@@ -0,0 +1,19 @@
+import os
+import sys
+import subprocess
+
+# Importing the package must not import the plotting libraries (they are only imported when a plot function is used)
+def test_import_does_not_load_plotting_libraries():
+
+    code = ('import gsiberror, sys\n'
+            'loaded = sorted(name for name in sys.modules if name.split(".")[0] in ("matplotlib", "cartopy", "mpl_toolkits"))\n'
+            'assert not loaded, loaded\n'
+            'assert callable(gsiberror.plot_amplitudes)\n')
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    env = dict(os.environ, MPLBACKEND='Agg', PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import gsiberror as gb
+from gsiberror.benchmark import write_synthetic
+from gsiberror.records import Layout, control_vars, detect_layout, iter_records
+
+kinds = ['balprojs', 'amplitudes', 'hscales', 'vscales']
+
+modes = [{}, {'lazy': True}, {'index': True}, {'native': True}]
+
+# This function writes a copy of a .gcv file (written by the GSI) with another layout (see detect_layout); the
+# records of the control variables in drop are not written
+def convert(src, dst, byteorder, marker, integer, real, drop=()):
+
+    mdt, idt, rdt = (byteorder + t + str(n) for t, n in (('i', marker), ('i', integer), ('f', real)))
+
+    chunks = []
+
+    def record(*payloads):
+        nbytes = np.array([sum(len(p) for p in payloads)], dtype=mdt).tobytes()
+        chunks.extend((nbytes,) + payloads + (nbytes,))
+
+    balprojs = []
+    skip = False
+
+    for var, kind, data in iter_records(src):
+        if kind == 'header':
+            record(np.asarray(data, dtype=idt).tobytes())
+        elif kind == 'balprojs':
+            balprojs.append(np.asarray(data, dtype=rdt).tobytes())
+            if len(balprojs) == 3:
+                record(*balprojs)
+        elif kind == 'tag':
+            skip = var in drop
+            if not skip:
+                record(var.ljust(5).encode('ascii'), np.asarray(data, dtype=idt).tobytes())
+        elif skip:
+            continue
+        elif var == 'q' and kind == 'amplitudes':
+            # The amplitudes of q and qin are in the same record
+            amplitudes_q = np.asarray(data, dtype=rdt).tobytes()
+        elif var == 'qin':
+            record(amplitudes_q, np.asarray(data, dtype=rdt).tobytes())
+        else:
+            record(np.asarray(data, dtype=rdt).tobytes())
+
+    with open(dst, 'wb') as fobj:
+        fobj.write(b''.join(chunks))
+
+# The layout of files with other byte orders, sizes of the markers, integers and reals and control variables is
+# detected and their records are read (in all the modes) with the values of the original file
+@pytest.mark.parametrize('byteorder, marker, integer, real, drop', [
+    ('<', 4, 4, 4, ()),
+    ('>', 8, 4, 4, ()),
+    ('>', 4, 8, 4, ()),
+    ('>', 4, 4, 8, ()),
+    ('<', 8, 8, 8, ()),
+    ('>', 4, 4, 4, ('oz', 'cw')),
+])
+def test_layouts(tmp_path, byteorder, marker, integer, real, drop):
+
+    src = write_synthetic(str(tmp_path / 'matrix.gcv'), 10, 20, 4)
+    dst = str(tmp_path / 'variant.gcv')
+
+    convert(src, dst, byteorder, marker, integer, real, drop)
+
+    with open(dst, 'rb') as fobj:
+        layout, grid = detect_layout(fobj)
+
+    variables = tuple(var for var in control_vars if var not in drop)
+
+    assert layout == Layout(byteorder, marker, integer, real, variables, True)
+    assert grid == (4, 10, 20)
+
+    bfile = gb.Berror(src)
+    bfile.read_records()
+
+    for mode in modes:
+
+        vfile = gb.Berror(dst)
+        vfile.read_records(**mode)
+
+        for kind in kinds:
+            expected = {var: da for var, da in getattr(bfile, kind).items() if var not in drop}
+            assert sorted(getattr(vfile, kind)) == sorted(expected)
+            for var, da in expected.items():
+                np.testing.assert_array_equal(getattr(vfile, kind)[var].values, da.values)
@@ -0,0 +1,45 @@
+import os
+import numpy as np
+
+import gsiberror as gb
+from gsiberror.benchmark import write_synthetic
+
+kinds = ['balprojs', 'amplitudes', 'hscales', 'vscales']
+
+# This function returns the array that owns the memory of a view
+def owner(arr):
+
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+
+    return arr
+
+# With native=True the records are converted in place: they are views (native float32) of the buffer decoded from
+# the file, with the same memory footprint (and values) of the records read with native=False
+def test_native_records_share_the_decoded_buffer(tmp_path):
+
+    file_name = write_synthetic(str(tmp_path / 'matrix.gcv'), 10, 20, 4)
+
+    bfile = gb.Berror(file_name)
+    bfile.read_records()
+
+    nfile = gb.Berror(file_name)
+    nfile.read_records(native=True)
+
+    recs = [getattr(nfile, kind)[var].values for kind in kinds for var in getattr(bfile, kind)]
+
+    buffer = owner(recs[0])
+
+    # The decoded buffer is the whole file without its first record marker
+    assert buffer.nbytes == os.path.getsize(file_name) - 4
+
+    for rec in recs:
+        assert rec.base is not None
+        assert np.shares_memory(rec, buffer)
+        assert rec.dtype == np.float32 and rec.dtype.isnative
+
+    assert sum(rec.nbytes for rec in recs) == sum(da.nbytes for kind in kinds for da in getattr(bfile, kind).values())
+
+    for kind in kinds:
+        for var, da in getattr(bfile, kind).items():
+            np.testing.assert_array_equal(getattr(nfile, kind)[var].values, da.values)
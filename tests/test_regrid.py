@@ -0,0 +1,20 @@
+import numpy as np
+
+from gsiberror.benchmark import synthetic_berror
+
+# The records regridded to explicit latitudes are interpolated to them and labelled with them
+def test_regrid_explicit_latitudes():
+
+    bfile = synthetic_berror(20, 40, 8)
+
+    lats = np.linspace(-30, 30, 10)
+
+    new = bfile.regrid(lats=lats)
+
+    np.testing.assert_array_equal(new.lats, lats)
+    np.testing.assert_array_equal(new.amplitudes['sf']['latitude'].values, lats)
+    np.testing.assert_array_equal(new.to_dataset()['latitude'].values, lats)
+
+    expected = np.array([np.interp(lats, bfile.lats, row) for row in bfile.amplitudes['sf'].values])
+
+    np.testing.assert_allclose(new.amplitudes['sf'].values, expected, rtol=1e-6)
@@ -0,0 +1,13 @@
+import gsiberror as gb
+from gsiberror.benchmark import write_synthetic
+
+# The records read from a .gcv file and written back (see to_gcv) give the same file, byte by byte
+def test_read_to_gcv_is_bit_identical(tmp_path):
+
+    file_name = write_synthetic(str(tmp_path / 'matrix.gcv'), 10, 20, 4)
+
+    bfile = gb.Berror(file_name)
+    bfile.read_records()
+    bfile.to_gcv(str(tmp_path / 'copy.gcv'))
+
+    assert (tmp_path / 'copy.gcv').read_bytes() == (tmp_path / 'matrix.gcv').read_bytes()
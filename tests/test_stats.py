@@ -0,0 +1,19 @@
+import numpy as np
+
+from gsiberror.stats import RecordStats, array_stats
+
+# The statistics ignore the NaN values and the minimum and maximum don't compute the other statistics
+def test_record_stats():
+
+    values = np.array([[np.nan, 1., -2.], [4., 0.5, np.nan]], dtype=np.float32)
+
+    rstats = RecordStats(values)
+
+    assert (rstats['min'], rstats['max']) == (-2., 4.)
+    assert sorted(rstats._stats) == ['max', 'min']
+
+    expected = array_stats(values)
+
+    assert dict(rstats) == expected
+    assert expected['nan'] == 2
+    np.testing.assert_allclose(expected['mean'], np.nanmean(values.astype(np.float64)))